@@ -0,0 +1,78 @@
+import numpy as np
+from scipy.sparse import csr_matrix, hstack, identity
+from scipy.sparse.csgraph import min_weight_full_bipartite_matching
+
+ASSIGNMENT_MODES = ['greedy', 'min-cost']
+
+
+def greedy_assignment(top_idx, top_scores):
+    """
+    One-to-one assignment over the top-k graph: repeatedly take the highest scoring
+    edge whose need and candidate are both still free.
+    :return: (assigned_idx, assigned_scores), with -1 / 0.0 for needs left unassigned
+    """
+    n_needs, k = top_idx.shape
+    assigned_idx = np.full(n_needs, -1, dtype=np.int64)
+    assigned_scores = np.zeros(n_needs, dtype=np.float64)
+
+    need_rows = np.repeat(np.arange(n_needs), k)
+    cand_cols = top_idx.ravel()
+    scores = top_scores.ravel()
+    # Highest score first, ties broken by need order then rank
+    edge_order = np.argsort(-scores, kind='stable')
+
+    taken = set()
+    for edge in edge_order:
+        score = scores[edge]
+        if score <= 0:
+            break
+        need, cand = need_rows[edge], cand_cols[edge]
+        if assigned_idx[need] != -1 or cand in taken:
+            continue
+        assigned_idx[need] = cand
+        assigned_scores[need] = score
+        taken.add(cand)
+    return assigned_idx, assigned_scores
+
+
+def min_cost_assignment(top_idx, top_scores):
+    """
+    One-to-one assignment over the top-k graph that maximises the total similarity.
+    Every need also gets a private "unassigned" column worth a score of 0, so a full
+    matching always exists and needs are only matched when that adds similarity.
+    :return: (assigned_idx, assigned_scores), with -1 / 0.0 for needs left unassigned
+    """
+    n_needs, k = top_idx.shape
+    assigned_idx = np.full(n_needs, -1, dtype=np.int64)
+    assigned_scores = np.zeros(n_needs, dtype=np.float64)
+
+    need_rows = np.repeat(np.arange(n_needs), k)
+    cand_cols = top_idx.ravel()
+    scores = top_scores.ravel()
+    keep = scores > 0
+    need_rows, cand_cols, scores = need_rows[keep], cand_cols[keep], scores[keep]
+    if len(scores) == 0:
+        return assigned_idx, assigned_scores
+
+    # Compact the candidate columns to the ones that appear in the graph
+    used_cands, cand_cols = np.unique(cand_cols, return_inverse=True)
+    # Costs must be non-zero: a real edge costs 2 - score, the unassigned column costs 2
+    similarity = csr_matrix((scores, (need_rows, cand_cols)), shape=(n_needs, len(used_cands)))
+    edges = csr_matrix((2.0 - scores, (need_rows, cand_cols)), shape=(n_needs, len(used_cands)))
+    graph = hstack([edges, 2.0 * identity(n_needs, format='csr')], format='csr')
+
+    row_ind, col_ind = min_weight_full_bipartite_matching(graph)
+    matched = col_ind < len(used_cands)
+    rows = row_ind[matched]
+    assigned_idx[rows] = used_cands[col_ind[matched]]
+    assigned_scores[rows] = np.asarray(similarity[rows, col_ind[matched]]).ravel()
+    return assigned_idx, assigned_scores
+
+
+def assign(top_idx, top_scores, mode):
+    if mode == 'greedy':
+        return greedy_assignment(top_idx, top_scores)
+    elif mode == 'min-cost':
+        return min_cost_assignment(top_idx, top_scores)
+    else:
+        raise ValueError(f"Unknown assignment mode: {mode}")
@@ -0,0 +1,178 @@
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+RESULTS_DIR = os.path.join("match_finder", "benchmark_results")
+
+# (candidates, needs) per named scale
+SCALES = {
+    'small': (10_000, 1_000),
+    'medium': (100_000, 10_000),
+    'large': (1_000_000, 100_000),
+}
+
+SYLLABLES = ['ba', 'ca', 'de', 'fi', 'go', 'ha', 'ji', 'ka', 'lo', 'mu', 'na', 'pe', 'qui', 'ra', 'si', 'to',
+             'vu', 'wa', 'xe', 'yo', 'za', 'an', 'er', 'in', 'on', 'us', 'tr', 'st', 'ph', 'ch']
+
+def synthetic_words(rng, size):
+    """Deterministic pseudo-words of 2-4 syllables"""
+    words = set()
+    while len(words) < size:
+        n_syllables = rng.integers(2, 5)
+        words.add(''.join(rng.choice(SYLLABLES, n_syllables)))
+    return np.array(sorted(words))
+
+def zipf_choice(rng, words, size, exponent=1.1):
+    # A few words are very common and most are rare, like real segment names
+    weights = 1.0 / np.arange(1, len(words) + 1) ** exponent
+    return rng.choice(words, size=size, p=weights / weights.sum())
+
+def generate_taxonomy(n_rows, data_source_id, rng, providers, categories, segment_words, first_cat_id=1_000_000):
+    """Hierarchical 'Provider > Category > Segment' names over a shared vocabulary"""
+    provider = rng.choice(providers, n_rows)
+    category = np.char.add(np.char.add(zipf_choice(rng, categories, n_rows), ' '),
+                           zipf_choice(rng, categories, n_rows))
+    segment_lengths = rng.integers(1, 5, n_rows)
+    segment_tokens = zipf_choice(rng, segment_words, segment_lengths.sum())
+    segments = [' '.join(tokens) for tokens in np.split(segment_tokens, np.cumsum(segment_lengths)[:-1])]
+    names = [f"{p.title()} > {c.title()} > {s}" for p, c, s in zip(provider, category, segments)]
+    return pd.DataFrame({
+        'data_source_id': data_source_id,
+        'data_source_cat_id': np.arange(first_cat_id, first_cat_id + n_rows, dtype=np.int64),
+        'name': names,
+    })
+
+def generate_needs(n_rows, candidates_df, rng, providers, categories, segment_words):
+    """Half of the needs are perturbed candidate names (one word replaced), the other half are fresh names"""
+    n_derived = n_rows // 2
+    fresh = generate_taxonomy(n_rows - n_derived, 18, rng, providers, categories, segment_words)
+    derived_names = candidates_df['name'].to_numpy()[rng.integers(0, len(candidates_df), n_derived)]
+    replacements = zipf_choice(rng, segment_words, n_derived)
+    derived_names = [name.rsplit(' ', 1)[0] + ' ' + word for name, word in zip(derived_names, replacements)]
+    names = np.concatenate([np.array(derived_names, dtype=object), fresh['name'].to_numpy(dtype=object)])
+    return pd.DataFrame({
+        'data_source_id': 18,
+        'data_source_cat_id': np.arange(2_000_000, 2_000_000 + n_rows, dtype=np.int64),
+        'name': names[rng.permutation(n_rows)],
+    })
+
+def write_synthetic_inputs(base_dir, n_candidates, n_needs, seed=0):
+    rng = np.random.default_rng(seed)
+    providers = synthetic_words(rng, 40)
+    categories = synthetic_words(rng, 400)
+    # The segment vocabulary grows with the taxonomy, as it does for real providers
+    segment_words = synthetic_words(rng, max(2_000, n_candidates // 20))
+
+    candidates_df = generate_taxonomy(n_candidates, 35, rng, providers, categories, segment_words)
+    needs_df = generate_needs(n_needs, candidates_df, rng, providers, categories, segment_words)
+    for directory, df in [("needs_match", needs_df), ("total_match_options", candidates_df)]:
+        os.makedirs(os.path.join(base_dir, "match_finder", directory), exist_ok=True)
+        df.to_csv(os.path.join(base_dir, "match_finder", directory, "data.csv"), index=False, header=False)
+
+def peak_rss_mb(who=resource.RUSAGE_SELF):
+    """Peak RSS of this process, or with RUSAGE_CHILDREN of its largest terminated child process"""
+    peak = resource.getrusage(who).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+def _run_case(case_dir, matcher_options, results):
+    # Runs in a fresh process so peak RSS only covers this case
+    from match_finder.matcher import run_matcher
+    os.chdir(case_dir)
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        start = time.perf_counter()
+        run_matcher(**matcher_options)
+        wall_time = time.perf_counter() - start
+    # Worker processes of --workers runs have all exited by now
+    results.put({'wall_time_s': wall_time, 'peak_rss_mb': peak_rss_mb(),
+                 'peak_worker_rss_mb': peak_rss_mb(resource.RUSAGE_CHILDREN)})
+
+def run_case(n_candidates, n_needs, matcher_options, seed=0):
+    with tempfile.TemporaryDirectory(prefix='match_finder_benchmark_') as case_dir:
+        write_synthetic_inputs(case_dir, n_candidates, n_needs, seed)
+        context = multiprocessing.get_context('spawn')
+        results = context.Queue()
+        process = context.Process(target=_run_case, args=(case_dir, matcher_options, results))
+        process.start()
+        process.join()
+        if process.exitcode != 0:
+            raise RuntimeError(f"Matcher failed for {n_candidates} candidates / {n_needs} needs")
+        measurement = results.get()
+    measurement['needs_per_sec'] = n_needs / measurement['wall_time_s']
+    return {'candidates': n_candidates, 'needs': n_needs, **measurement}
+
+def current_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the matcher on synthetic taxonomies')
+    parser.add_argument('--scales', nargs='+', choices=list(SCALES), default=['small', 'medium'],
+                        help='Named (candidates, needs) sizes: small=10k/1k, medium=100k/10k, large=1M/100k '
+                             '(default: small medium)')
+    parser.add_argument('--candidates', type=int, nargs='+', default=None,
+                        help='Candidate counts to run instead of --scales (crossed with --needs)')
+    parser.add_argument('--needs', type=int, nargs='+', default=None,
+                        help='Need counts to run instead of --scales (crossed with --candidates)')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the synthetic taxonomy generator')
+    # Matcher options under test
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--prune', action='store_true')
+    parser.add_argument('--backend', choices=['tfidf', 'hashing'], default='tfidf')
+    parser.add_argument('--top-k', type=int, default=None)
+    parser.add_argument('--chunk-size', type=int, default=None)
+    args = parser.parse_args()
+    if args.chunk_size is not None and args.top_k:
+        parser.error("--chunk-size cannot be combined with --top-k")
+
+    if args.candidates or args.needs:
+        cases = [(c, n) for c in args.candidates or [SCALES['small'][0]] for n in args.needs or [SCALES['small'][1]]]
+    else:
+        cases = [SCALES[scale] for scale in args.scales]
+    # The index cache is disabled so every case includes fitting the vectorizer
+    matcher_options = {'workers': args.workers, 'prune': args.prune, 'backend': args.backend,
+                       'top_k': args.top_k, 'chunk_size': args.chunk_size, 'use_index_cache': False}
+
+    results = []
+    for n_candidates, n_needs in cases:
+        print(f"Running {n_candidates:,} candidates x {n_needs:,} needs...")
+        result = run_case(n_candidates, n_needs, matcher_options, args.seed)
+        print(f"- {result['wall_time_s']:.2f}s, {result['needs_per_sec']:,.0f} needs/sec, "
+              f"peak RSS {result['peak_rss_mb']:,.0f} MB, {result['peak_worker_rss_mb']:,.0f} MB per worker")
+        results.append(result)
+
+    commit = current_commit()
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    output_file = os.path.join(RESULTS_DIR, f"{timestamp}_{commit}.json")
+    with open(output_file, 'w') as f:
+        json.dump({
+            'commit': commit,
+            'timestamp': timestamp,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'seed': args.seed,
+            'matcher_options': matcher_options,
+            'results': results,
+        }, f, indent=2)
+    print(f"Benchmark results saved to: {output_file}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
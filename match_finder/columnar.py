@@ -0,0 +1,122 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+# Category and data source ids are always stored as 64-bit integers, never as floats
+ID_COLUMNS = ['data_source_id', 'data_source_cat_id', 'best_match_data_source_id', 'best_match_data_source_cat_id',
+              'origin_data_source_category_id', 'target_data_source_category_id']
+
+TABLE_EXTENSION = '.npz'
+CSV_EXTENSION = '.csv'
+
+
+def _column_arrays(name, series):
+    """Typed arrays for one column: values, plus a null mask when the column has nulls"""
+    nulls = series.isna().to_numpy()
+    if pd.api.types.is_unsigned_integer_dtype(series.dtype):
+        return 'uint64', {name: series.to_numpy().astype(np.uint64)}
+    if name in ID_COLUMNS or pd.api.types.is_integer_dtype(series.dtype):
+        values = series.fillna(0).to_numpy().astype(np.int64)
+        kind = 'int64'
+    elif pd.api.types.is_float_dtype(series.dtype):
+        return 'float64', {name: series.to_numpy(dtype=np.float64)}
+    elif pd.api.types.is_bool_dtype(series.dtype):
+        values = series.fillna(False).to_numpy(dtype=bool)
+        kind = 'bool'
+    else:
+        # UTF-8 text of all the values plus their character offsets, so long values cost no padding
+        strings = series.fillna('').astype(str).tolist()
+        text = ''.join(strings)
+        offsets = np.zeros(len(strings) + 1, dtype=np.uint32 if len(text) < 2 ** 32 else np.int64)
+        np.cumsum([len(value) for value in strings], out=offsets[1:])
+        text = text.encode('utf-8')
+        values = np.frombuffer(text, dtype=np.uint8)
+        arrays = {name: values, f"{name}__offsets": offsets}
+        if nulls.any():
+            arrays[f"{name}__nulls"] = nulls
+        return 'utf8', arrays
+    arrays = {name: values}
+    if nulls.any():
+        arrays[f"{name}__nulls"] = nulls
+    return kind, arrays
+
+
+def write_table(df, path):
+    """
+    Write a DataFrame as a typed columnar table (one numpy array per column in an .npz file).
+    Reading it back needs no parsing or dtype inference.
+    """
+    columns = []
+    arrays = {}
+    for name in df.columns:
+        kind, column_arrays = _column_arrays(name, df[name])
+        columns.append({'name': name, 'kind': kind})
+        arrays.update(column_arrays)
+    arrays['__columns__'] = np.array(json.dumps(columns))
+
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f"{path}.tmp{TABLE_EXTENSION}"
+    np.savez(tmp_path, **arrays)
+    os.replace(tmp_path, path)
+
+
+def read_table(path):
+    with np.load(path, allow_pickle=False) as table:
+        columns = json.loads(str(table['__columns__']))
+        data = {}
+        for column in columns:
+            name, kind = column['name'], column['kind']
+            values = table[name]
+            nulls = table[f"{name}__nulls"] if f"{name}__nulls" in table.files else None
+            if kind == 'int64' and nulls is not None:
+                data[name] = pd.arrays.IntegerArray(values, nulls)
+            elif kind == 'utf8':
+                text = values.tobytes().decode('utf-8')
+                offsets = table[f"{name}__offsets"].tolist()
+                values = np.array([text[start:end] for start, end in zip(offsets[:-1], offsets[1:])], dtype=object)
+                if nulls is not None:
+                    values[nulls] = np.nan
+                data[name] = values
+            else:
+                data[name] = values
+    return pd.DataFrame(data, columns=[column['name'] for column in columns])
+
+
+def stage_paths(stage_base):
+    """(table, csv) paths of a stage output given without extension, e.g. match_finder/suggested_match/data"""
+    return stage_base + TABLE_EXTENSION, stage_base + CSV_EXTENSION
+
+
+def write_stage(df, stage_base, export_csv=True):
+    """Write a stage output as a typed table, plus a CSV copy for review when export_csv is set"""
+    table_path, csv_path = stage_paths(stage_base)
+    os.makedirs(os.path.dirname(stage_base), exist_ok=True)
+    # The CSV goes first so the table is never older than it (see read_stage)
+    if export_csv:
+        df.to_csv(csv_path, index=False)
+    elif os.path.exists(csv_path):
+        # Never leave a CSV behind that no longer matches the table
+        os.remove(csv_path)
+    write_table(df, table_path)
+
+
+def read_stage(stage_base):
+    """
+    Read a stage output from its typed table. The CSV is read instead when there is no table or
+    the CSV is newer (it was edited by hand or written by a streaming run), with explicit int64 ids.
+    """
+    table_path, csv_path = stage_paths(stage_base)
+    if os.path.exists(table_path) and not (
+            os.path.exists(csv_path) and os.path.getmtime(csv_path) > os.path.getmtime(table_path)):
+        return read_table(table_path)
+    header = pd.read_csv(csv_path, nrows=0).columns
+    return pd.read_csv(csv_path, float_precision='round_trip',
+                       dtype={column: 'Int64' for column in ID_COLUMNS if column in header})
+
+
+def remove_table(stage_base):
+    table_path, _ = stage_paths(stage_base)
+    if os.path.exists(table_path):
+        os.remove(table_path)
@@ -2,13 +2,15 @@ import pandas as pd
 import os
 import sys
 
+from match_finder.columnar import read_stage
+
 def create_mapping(output_name=None):
     if output_name is None:
         print("Error: Output name is required")
         sys.exit(1)
         
-    # Read the suggested matches
-    suggested_matches = pd.read_csv(os.path.join("match_finder", "suggested_match", "data.csv"))
+    # Read the suggested matches (ids stay int64, never floats)
+    suggested_matches = read_stage(os.path.join("match_finder", "suggested_match", "data"))
     
     # Create mapping dataframe with required columns
     mapping_df = pd.DataFrame({
@@ -0,0 +1,64 @@
+import numpy as np
+import pandas as pd
+from scipy.sparse import vstack
+
+from match_finder.hashing_backend import HashedTfidfVectorizer
+
+# Rows fetched per round trip from the server-side cursor
+DB_BATCH_SIZE = 10_000
+
+CATEGORIES_QUERY = """
+    select data_source_id, data_source_category_id, name
+    from tpa.categories
+    where data_source_id = %s
+    order by data_source_category_id
+"""
+
+def stream_categories(data_source_id, batch_size=DB_BATCH_SIZE):
+    """Yield the tpa.categories rows of a data source as DataFrames of up to batch_size rows"""
+    # Imported here so the CSV-based commands do not need database credentials or psycopg2
+    from python.utils.db_util import execute_fetch_batches_with_vars_query
+
+    for rows in execute_fetch_batches_with_vars_query(CATEGORIES_QUERY, (data_source_id,), batch_size):
+        batch = pd.DataFrame(rows, columns=['data_source_id', 'data_source_cat_id', 'name'])
+        yield batch.astype({'data_source_id': 'int64', 'data_source_cat_id': 'int64'})
+
+def read_categories(data_source_id, batch_size=DB_BATCH_SIZE):
+    batches = list(stream_categories(data_source_id, batch_size))
+    if not batches:
+        raise ValueError(f"No categories found in tpa.categories for data_source_id {data_source_id}")
+    return pd.concat(batches, ignore_index=True)
+
+def fit_candidates_from_db(data_source_id, vectorizer, batch_size=DB_BATCH_SIZE):
+    """
+    Fit the vectorizer on a data source's categories while they are fetched: names are fed to
+    the vectorizer as batches arrive, and only the id and name columns are kept alongside.
+    :return: (total_match_df, can_tfidf)
+    """
+    data_source_ids, cat_ids, names = [], [], []
+
+    def category_batches():
+        for batch in stream_categories(data_source_id, batch_size):
+            data_source_ids.append(batch['data_source_id'].to_numpy())
+            cat_ids.append(batch['data_source_cat_id'].to_numpy())
+            names.append(batch['name'].to_numpy(dtype=object))
+            yield batch['name'].fillna('')
+
+    hashed = isinstance(vectorizer, HashedTfidfVectorizer)
+    if hashed:
+        count_chunks = [vectorizer.partial_fit_transform(batch_names) for batch_names in category_batches()]
+    else:
+        documents = (name for batch_names in category_batches() for name in batch_names)
+        can_tfidf = vectorizer.fit_transform(documents)
+
+    if not names:
+        raise ValueError(f"No categories found in tpa.categories for data_source_id {data_source_id}")
+    if hashed:
+        vectorizer.finish_fit()
+        can_tfidf = vectorizer.weight(vstack(count_chunks, format='csr'))
+    total_match_df = pd.DataFrame({
+        'data_source_id': np.concatenate(data_source_ids),
+        'data_source_cat_id': np.concatenate(cat_ids),
+        'name': np.concatenate(names),
+    })
+    return total_match_df, can_tfidf
@@ -1,86 +1,170 @@
 import pandas as pd
-import json
+import glob
 import os
 import sys
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
-import subprocess
-
-def calculate_size_change(original_size, new_size):
-    """Calculate the percentage change between two sizes"""
-    if original_size == 0:
-        return 0
-    return round((new_size / original_size) * 100)
-
-def enrich_mapping_with_sizes(source_id, target_id, mapping_file_name):
-    # First ensure we have current size data by running get-sizes
-    subprocess.run(['poetry', 'run', 'get-sizes'], check=True)
-
-    with open('match_finder/current_cat_sizes/data.json', 'r') as f:
-        size_data = json.load(f)
-    
-    # Get audience size for a data source and category
-    def get_audience_size(data_source_id, cat_id):
-        try:
-            return size_data['data_source_counts'][str(data_source_id)]['counts'][str(cat_id)]
-        except (KeyError, TypeError):
-            return 0
-    
-    input_file = f'mapping_files/{mapping_file_name}'
-    output_dir = 'qa_size'
-    os.makedirs(output_dir, exist_ok=True)
-    
+
+from match_finder.enrichment import category_sizes, print_size_statistics, size_change, size_statistics
+from match_finder.get_current_sizes import load_size_snapshot
+from match_finder.size_store import SizeStore
+
+MAPPING_DIR = 'mapping_files'
+OUTPUT_DIR = 'qa_size'
+
+# Size store of the current worker process, set once by _init_worker
+_worker_sizes = None
+
+
+def enrich_mapping_file(sizes, source_id, target_id, mapping_file_name, timestamp, name_with_ids=False):
+    """
+    Add origin/target sizes and the size change to one mapping file and write it to qa_size/.
+    :param name_with_ids: add the source and target IDs to the output file name, for batches that
+                          may enrich the same mapping file for several data source pairs
+    :return: (output_file, enriched DataFrame)
+    """
+    input_file = f'{MAPPING_DIR}/{mapping_file_name}'
+    base_name = os.path.splitext(mapping_file_name)[0]
+    if name_with_ids:
+        base_name = f'{base_name}_{source_id}_to_{target_id}'
+    output_file = f'{OUTPUT_DIR}/{timestamp}_{base_name}_with_size.csv'
+
+    df = pd.read_csv(input_file)
+
+    # Add size columns using the provided source_id and target_id
+    df['origin_data_source_category_size'] = category_sizes(sizes, source_id, df['origin_data_source_category_id'])
+    df['target_data_source_category_size'] = category_sizes(sizes, target_id, df['target_data_source_category_id'])
+
+    # Calculate size change percentage
+    df['size_change'] = size_change(df['origin_data_source_category_size'], df['target_data_source_category_size'])
+
+    # Save enriched data
+    df.to_csv(output_file, index=False)
+    return output_file, df
+
+def enrich_mapping_with_sizes(source_id, target_id, mapping_file_name, max_age=None):
+    # Current size data, downloaded again only when the stored snapshot is older than max_age seconds
+    sizes = load_size_snapshot(max_age)
+
+    input_file = f'{MAPPING_DIR}/{mapping_file_name}'
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+
     # Add timestamp to output filename
     timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-    base_name = os.path.splitext(mapping_file_name)[0]
-    output_file = f'{output_dir}/{timestamp}_{base_name}_with_size.csv'
-    
+
     try:
-        df = pd.read_csv(input_file)
-        
-        # Add size columns using the provided source_id and target_id
-        df['origin_data_source_category_size'] = df.apply(
-            lambda row: get_audience_size(source_id, row['origin_data_source_category_id']),
-            axis=1
-        )
-        
-        df['target_data_source_category_size'] = df.apply(
-            lambda row: get_audience_size(target_id, row['target_data_source_category_id']),
-            axis=1
-        )
-        
-        # Calculate size change percentage
-        df['size_change'] = df.apply(
-            lambda row: calculate_size_change(row['origin_data_source_category_size'], row['target_data_source_category_size']),
-            axis=1
-        )
-        
-        # Save enriched data
-        df.to_csv(output_file, index=False)
+        output_file, df = enrich_mapping_file(sizes, source_id, target_id, mapping_file_name, timestamp)
         print(f"Successfully processed {input_file} -> {output_file}")
-        
-        print(f"\nStatistics for {mapping_file_name}:")
-        print(f"Total rows processed: {len(df)}")
-        print(f"Average size change: {df['size_change'].mean():.2f}%")
-        print(f"Median size change: {df['size_change'].median():.2f}%")
-        print(f"Rows with size increase: {len(df[df['size_change'] > 100])}")
-        print(f"Rows with size decrease: {len(df[df['size_change'] < 100])}")
-        print(f"Rows with no change: {len(df[df['size_change'] == 100])}\n")
-        
+
+        print_size_statistics(df, mapping_file_name)
+
     except Exception as e:
         print(f"Error processing {input_file}: {str(e)}")
         return 1
     return 0
 
+def _init_worker(store_path):
+    # Every worker memory-maps the same size store instead of receiving a pickled copy
+    global _worker_sizes
+    _worker_sizes = SizeStore(store_path)
+
+def _enrich_batch_entry(entry):
+    source_id, target_id, mapping_file_name, timestamp = entry
+    summary = {'mapping_file': mapping_file_name, 'source_id': source_id, 'target_id': target_id}
+    try:
+        output_file, df = enrich_mapping_file(_worker_sizes, source_id, target_id, mapping_file_name, timestamp,
+                                              name_with_ids=True)
+        summary.update(size_statistics(df), output_file=output_file, error=None)
+    except Exception as e:
+        summary['error'] = str(e)
+    return summary
+
+def read_manifest(manifest_file):
+    """(source_id, target_id, mapping_file) of every row of a manifest CSV"""
+    manifest = pd.read_csv(manifest_file, dtype={'source_id': 'int64', 'target_id': 'int64', 'mapping_file': str})
+    return list(manifest[['source_id', 'target_id', 'mapping_file']].itertuples(index=False, name=None))
+
+def glob_mapping_files(source_id, target_id, pattern):
+    """(source_id, target_id, mapping_file) of every file in mapping_files/ matching the pattern"""
+    paths = sorted(glob.glob(os.path.join(MAPPING_DIR, pattern)))
+    return [(source_id, target_id, os.path.relpath(path, MAPPING_DIR)) for path in paths if os.path.isfile(path)]
+
+def enrich_mappings_batch(entries, max_age=None, workers=None):
+    """
+    Enrich several mapping files with one size snapshot, spread over a pool of worker processes.
+    Writes every file's qa_size/ output and a combined summary of their size change statistics.
+    """
+    if not entries:
+        print("Error: No mapping files to enrich")
+        return 1
+    unique_entries = list(dict.fromkeys((int(source_id), int(target_id), mapping_file)
+                                        for source_id, target_id, mapping_file in entries))
+    if len(unique_entries) < len(entries):
+        print(f"Skipping {len(entries) - len(unique_entries)} duplicate entries")
+        entries = unique_entries
+    sizes = load_size_snapshot(max_age)
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+
+    workers = min(workers or os.cpu_count() or 1, len(entries))
+    print(f"Enriching {len(entries)} mapping files with {workers} workers...")
+    batch = [(source_id, target_id, mapping_file, timestamp) for source_id, target_id, mapping_file in entries]
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(sizes.store_path,)) as executor:
+        summaries = list(executor.map(_enrich_batch_entry, batch))
+
+    summary_df = pd.DataFrame(summaries, columns=[
+        'mapping_file', 'source_id', 'target_id', 'rows', 'average_size_change', 'median_size_change',
+        'size_increase', 'size_decrease', 'no_change', 'output_file', 'error'])
+    # Counts stay integers when some files failed
+    summary_df = summary_df.astype({column: 'Int64' for column in ['rows', 'size_increase', 'size_decrease', 'no_change']})
+    summary_file = f'{OUTPUT_DIR}/{timestamp}_summary.csv'
+    summary_df.to_csv(summary_file, index=False)
+
+    for summary in summary_df.itertuples(index=False):
+        if summary.error is None or pd.isna(summary.error):
+            print(f"- {summary.mapping_file}: {summary.rows} rows, average size change "
+                  f"{summary.average_size_change:.2f}%, median {summary.median_size_change:.2f}% "
+                  f"-> {summary.output_file}")
+        else:
+            print(f"- Error processing {MAPPING_DIR}/{summary.mapping_file}: {summary.error}")
+    print(f"\nSummary of {len(summary_df)} mapping files saved to: {summary_file}")
+    return 1 if summary_df['error'].notna().any() else 0
+
 def main():
     import argparse
-    
+
     parser = argparse.ArgumentParser(description='Enrich mapping file with size data')
-    parser.add_argument('source_id', type=int, help='Source data source ID')
-    parser.add_argument('target_id', type=int, help='Target data source ID')
-    parser.add_argument('mapping_file', type=str, help='Name of the mapping file in mapping_files directory')
-    
+    parser.add_argument('source_id', type=int, nargs='?', help='Source data source ID')
+    parser.add_argument('target_id', type=int, nargs='?', help='Target data source ID')
+    parser.add_argument('mapping_file', type=str, nargs='?',
+                        help='Name of the mapping file in mapping_files directory')
+    parser.add_argument('--manifest', type=str, default=None,
+                        help='CSV with source_id,target_id,mapping_file columns: enrich every listed file')
+    parser.add_argument('--glob', type=str, default=None,
+                        help='Enrich every file in mapping_files matching this pattern (e.g. "*lr*.csv") '
+                             'with the given source and target IDs')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Worker processes for --manifest/--glob (default: number of CPUs)')
+    parser.add_argument('--sizes-max-age', type=float, default=None,
+                        help='Reuse category sizes downloaded less than this many seconds ago '
+                             '(default: $CAT_SIZES_MAX_AGE_SECONDS or 900, 0 always revalidates)')
+
     args = parser.parse_args()
-    return enrich_mapping_with_sizes(args.source_id, args.target_id, args.mapping_file)
+    if args.manifest is not None:
+        if args.glob is not None or args.source_id is not None:
+            parser.error("--manifest lists the source and target IDs of every file, give no other files or IDs")
+        return enrich_mappings_batch(read_manifest(args.manifest), args.sizes_max_age, args.workers)
+    if args.target_id is None:
+        parser.error("source_id and target_id are required unless --manifest is given")
+    if args.glob is not None:
+        if args.mapping_file is not None:
+            parser.error("give either a mapping file or --glob, not both")
+        entries = glob_mapping_files(args.source_id, args.target_id, args.glob)
+        return enrich_mappings_batch(entries, args.sizes_max_age, args.workers)
+    if args.mapping_file is None:
+        parser.error("mapping_file is required unless --manifest or --glob is given")
+    return enrich_mapping_with_sizes(args.source_id, args.target_id, args.mapping_file, args.sizes_max_age)
 
 if __name__ == "__main__":
-    sys.exit(main()) 
\ No newline at end of file
+    sys.exit(main())
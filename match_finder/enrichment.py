@@ -0,0 +1,56 @@
+import numpy as np
+import pandas as pd
+
+
+def category_sizes(sizes, data_source_ids, cat_ids):
+    """
+    Audience sizes of the given categories from a SizeStore as an int64 array, 0 for categories
+    without a size. data_source_ids may be a single id shared by all categories; missing ids (NA)
+    get size 0.
+    """
+    cat_ids = pd.array(cat_ids, dtype='Int64')
+    data_source_ids = (pd.array(np.full(len(cat_ids), data_source_ids), dtype='Int64')
+                       if np.isscalar(data_source_ids) else pd.array(data_source_ids, dtype='Int64'))
+    known = ~(cat_ids.isna() | data_source_ids.isna())
+    known_data_sources = data_source_ids[known].to_numpy(dtype=np.int64)
+    known_cats = cat_ids[known].to_numpy(dtype=np.int64)
+
+    known_sizes = np.zeros(len(known_cats), dtype=np.int64)
+    for data_source_id in np.unique(known_data_sources):
+        in_data_source = known_data_sources == data_source_id
+        known_sizes[in_data_source] = sizes.lookup(int(data_source_id), known_cats[in_data_source])
+    result = np.zeros(len(cat_ids), dtype=np.int64)
+    result[known] = known_sizes
+    return result
+
+
+def size_change(original_sizes, new_sizes):
+    """Percentage of the original size reached by the new size, 0 when there is no original size"""
+    original_sizes = np.asarray(original_sizes, dtype=np.int64)
+    new_sizes = np.asarray(new_sizes, dtype=np.int64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        change = np.round(new_sizes / original_sizes * 100)
+    return np.where(original_sizes == 0, 0, change).astype(np.int64)
+
+
+def size_statistics(df):
+    """Size change statistics of an enriched file, as printed by print_size_statistics"""
+    return {
+        'rows': len(df),
+        'average_size_change': df['size_change'].mean(),
+        'median_size_change': df['size_change'].median(),
+        'size_increase': int((df['size_change'] > 100).sum()),
+        'size_decrease': int((df['size_change'] < 100).sum()),
+        'no_change': int((df['size_change'] == 100).sum()),
+    }
+
+
+def print_size_statistics(df, name):
+    statistics = size_statistics(df)
+    print(f"\nStatistics for {name}:")
+    print(f"Total rows processed: {statistics['rows']}")
+    print(f"Average size change: {statistics['average_size_change']:.2f}%")
+    print(f"Median size change: {statistics['median_size_change']:.2f}%")
+    print(f"Rows with size increase: {statistics['size_increase']}")
+    print(f"Rows with size decrease: {statistics['size_decrease']}")
+    print(f"Rows with no change: {statistics['no_change']}\n")
@@ -8,12 +8,17 @@ def main():
     parser = argparse.ArgumentParser(description='Find matches and enrich with size data')
     parser.add_argument('threshold', nargs='?', type=float, default=0.60,
                        help='Similarity threshold (between 0 and 1, default: 0.60)')
+    parser.add_argument('--sizes-max-age', type=float, default=None,
+                       help='Reuse category sizes downloaded less than this many seconds ago '
+                            '(default: $CAT_SIZES_MAX_AGE_SECONDS or 900, 0 always revalidates)')
     
-    args = parser.parse_args()
+    # Any other options (e.g. --top-k) are passed through to the matcher
+    args, matcher_args = parser.parse_known_args()
     
     # Update sys.argv for the matcher
-    # Remove our script name and keep any additional args
-    sys.argv = [sys.argv[0]] + [str(args.threshold)]
+    # Remove our script name and keep any additional args. The matcher only writes the typed
+    # tables, the CSV files for review are the enriched ones
+    sys.argv = [sys.argv[0]] + [str(args.threshold)] + matcher_args + ['--no-csv']
     
     # First run the matcher
     result = matcher_main()
@@ -22,7 +27,7 @@ def main():
         return result
         
     # Then enrich with sizes
-    enrich_data_with_sizes()
+    enrich_data_with_sizes(args.sizes_max_age)
     return 0
 
 if __name__ == "__main__":
@@ -1,34 +1,155 @@
 import requests
 import json
 import os
+import shutil
+import time
 from datetime import datetime
 
-def fetch_and_store_cat_sizes():
-    url = "http://a48e0dc5459e74ed9a460f718d19f2e8-a863d546fb12e42c.elb.us-west-2.amazonaws.com/totals"
-    headers = {
-        "Host": "audience-service-prod.core-prod.k8.steelhouse.com"
+from match_finder.size_store import SizeStore, SizeStoreWriter
+from match_finder.totals_parser import iter_data_source_counts
+
+SIZES_URL = "http://a48e0dc5459e74ed9a460f718d19f2e8-a863d546fb12e42c.elb.us-west-2.amazonaws.com/totals"
+SIZES_HEADERS = {
+    "Host": "audience-service-prod.core-prod.k8.steelhouse.com",
+    "Accept-Encoding": "gzip",
+}
+# Bytes of the (decompressed) response parsed at a time
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+SIZES_DIR = os.path.join("match_finder", "current_cat_sizes")
+# Fetch time, validators (ETag / Last-Modified) and size store directory of the current snapshot
+SIZES_META_FILE = os.path.join(SIZES_DIR, "meta.json")
+
+# A stored snapshot younger than this is used without contacting the audience service
+DEFAULT_SIZES_MAX_AGE_SECONDS = 15 * 60
+SIZES_MAX_AGE_ENV = "CAT_SIZES_MAX_AGE_SECONDS"
+
+# Size store already opened by this process
+_loaded_snapshot = {'store': None}
+
+
+def sizes_max_age(max_age=None):
+    if max_age is not None:
+        return max_age
+    return float(os.environ.get(SIZES_MAX_AGE_ENV, DEFAULT_SIZES_MAX_AGE_SECONDS))
+
+def read_meta():
+    if not os.path.exists(SIZES_META_FILE):
+        return None
+    with open(SIZES_META_FILE, 'r') as f:
+        meta = json.load(f)
+    if not meta.get('store') or not os.path.isdir(os.path.join(SIZES_DIR, meta['store'])):
+        return None
+    return meta
+
+def write_meta(meta):
+    with open(SIZES_META_FILE + ".tmp", 'w') as f:
+        json.dump(meta, f)
+    os.replace(SIZES_META_FILE + ".tmp", SIZES_META_FILE)
+
+def refresh_size_snapshot(meta=None):
+    """
+    Download the category sizes, asking the service to answer 304 Not Modified when the stored
+    snapshot is still current. Returns the metadata of the stored snapshot.
+    """
+    headers = dict(SIZES_HEADERS)
+    if meta is not None:
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+
+    start = time.perf_counter()
+    with requests.get(SIZES_URL, headers=headers, stream=True) as response:
+        if response.status_code == 304 and meta is not None:
+            meta['fetched_at'] = time.time()
+            write_meta(meta)
+            print("Category sizes not modified since the last download")
+            return meta
+        response.raise_for_status()
+        first_byte = time.perf_counter() - start
+
+        # Parse the response as it arrives and write every data source to a new size store
+        # straight away; meta.json is only switched over to it once it is complete
+        fetched_at = time.time()
+        store_name = f"store_{int(fetched_at * 1000)}"
+        writer = SizeStoreWriter(SIZES_DIR, store_name)
+        received = {'bytes': 0}
+
+        def counted_chunks():
+            for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                received['bytes'] += len(chunk)
+                yield chunk
+
+        try:
+            for data_source_id, data_source in iter_data_source_counts(counted_chunks()):
+                writer.add(data_source_id, data_source.get('counts') if isinstance(data_source, dict) else None)
+            store_path = writer.commit()
+        except BaseException:
+            writer.abort()
+            raise
+        # Bytes read from the connection, before decompression
+        transferred = response.raw.tell()
+
+    elapsed = time.perf_counter() - start
+    print(f"Downloaded category sizes in {elapsed:.2f}s ({first_byte:.2f}s to first byte): "
+          f"{received['bytes'] / 1e6:.1f} MB, {transferred / 1e6:.1f} MB transferred "
+          f"({response.headers.get('Content-Encoding') or 'uncompressed'}), "
+          f"{len(writer.data_sources)} data sources, {sum(writer.data_sources.values())} categories")
+    meta = {
+        'fetched_at': fetched_at,
+        'etag': response.headers.get('ETag'),
+        'last_modified': response.headers.get('Last-Modified'),
+        'store': store_name,
     }
-    
+    write_meta(meta)
+    remove_old_stores(keep=store_name)
+    print(f"Successfully stored category sizes in: {store_path}")
+    return meta
+
+def remove_old_stores(keep):
+    # Open memory maps of a removed store stay readable until they are closed
+    for name in os.listdir(SIZES_DIR):
+        path = os.path.join(SIZES_DIR, name)
+        if name != keep and name.startswith('store_') and os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        elif name == "data.json":
+            # Snapshot format of earlier versions
+            os.remove(path)
+
+def load_size_snapshot(max_age=None):
+    """
+    SizeStore of the stored category sizes, downloaded again (or revalidated) only when it is
+    older than max_age seconds (default: $CAT_SIZES_MAX_AGE_SECONDS or 15 minutes).
+    If the service cannot be reached, an older snapshot is used rather than failing.
+    """
+    meta = read_meta()
+    age = None if meta is None else time.time() - meta['fetched_at']
+    if age is None or age > sizes_max_age(max_age):
+        try:
+            meta = refresh_size_snapshot(meta)
+        except requests.exceptions.RequestException as e:
+            if meta is None:
+                raise
+            print(f"Error making request: {str(e)}")
+            print(f"Using category sizes downloaded {age / 60:.0f} minutes ago")
+    else:
+        fetched = datetime.fromtimestamp(meta['fetched_at']).strftime('%Y-%m-%d %H:%M:%S')
+        print(f"Using category sizes downloaded at {fetched}")
+
+    store_path = os.path.join(SIZES_DIR, meta['store'])
+    if _loaded_snapshot['store'] is None or _loaded_snapshot['store'].store_path != store_path:
+        _loaded_snapshot['store'] = SizeStore(store_path)
+    return _loaded_snapshot['store']
+
+def fetch_and_store_cat_sizes():
     try:
-        response = requests.get(url, headers=headers)
-        response.raise_for_status()
-        data = response.json()
-        
-        # Ensure the directory exists
-        output_dir = "match_finder/current_cat_sizes"
-        os.makedirs(output_dir, exist_ok=True)
-        
-        # Write the response to a file
-        output_file = f"{output_dir}/data.json"
-        with open(output_file, 'w') as f:
-            json.dump(data, f, indent=2)
-            
-        print(f"Successfully stored category sizes in: {output_file}")
-        
+        # Always revalidate when called directly
+        refresh_size_snapshot(read_meta())
     except requests.exceptions.RequestException as e:
         print(f"Error making request: {str(e)}")
     except Exception as e:
         print(f"Error processing or storing data: {str(e)}")
 
 if __name__ == "__main__":
-    fetch_and_store_cat_sizes()
\ No newline at end of file
+    fetch_and_store_cat_sizes()
@@ -0,0 +1,65 @@
+import numpy as np
+import pandas as pd
+from scipy.sparse import vstack
+from sklearn.feature_extraction.text import HashingVectorizer
+from sklearn.preprocessing import normalize
+
+# Width of the hashed feature space; memory for the IDF weights is fixed by this, not by the vocabulary
+DEFAULT_HASH_FEATURES = 2 ** 20
+CANDIDATE_CHUNK_SIZE = 100_000
+
+
+class HashedTfidfVectorizer:
+    """
+    TF-IDF weighting over hashed token features. Tokenisation and the smoothed IDF formula are
+    the same as TfidfVectorizer(stop_words='english'), but there is no vocabulary dict, and the
+    document frequencies are accumulated chunk by chunk.
+    """
+
+    def __init__(self, n_features=DEFAULT_HASH_FEATURES):
+        self.hashing = HashingVectorizer(stop_words='english', n_features=n_features,
+                                         alternate_sign=False, norm=None)
+        self.document_frequency = np.zeros(n_features, dtype=np.int64)
+        self.n_documents = 0
+        self.idf_ = None
+
+    def partial_fit_transform(self, texts):
+        """Count the tokens of a chunk of candidates and add them to the document frequencies"""
+        counts = self.hashing.transform(texts)
+        self.document_frequency += np.bincount(counts.indices, minlength=len(self.document_frequency))
+        self.n_documents += counts.shape[0]
+        return counts
+
+    def finish_fit(self):
+        self.idf_ = np.log((1 + self.n_documents) / (1 + self.document_frequency)) + 1
+        # Tokens no candidate has are dropped, as they are out of TfidfVectorizer's vocabulary
+        self.idf_[self.document_frequency == 0] = 0
+        return self
+
+    def weight(self, counts):
+        counts = counts.tocsr().astype(np.float64)
+        counts.data *= self.idf_[counts.indices]
+        counts.eliminate_zeros()
+        return normalize(counts)
+
+    def transform(self, texts):
+        return self.weight(self.hashing.transform(texts))
+
+
+def build_hashed_index(candidates_path, n_features=DEFAULT_HASH_FEATURES, chunk_size=CANDIDATE_CHUNK_SIZE):
+    """
+    Read the candidate file in chunks and build the hashed TF-IDF matrix incrementally.
+    :return: (total_match_df, vectorizer, can_tfidf)
+    """
+    vectorizer = HashedTfidfVectorizer(n_features)
+    frames = []
+    count_chunks = []
+    for chunk in pd.read_csv(candidates_path, names=['data_source_id', 'data_source_cat_id', 'name'],
+                             chunksize=chunk_size):
+        count_chunks.append(vectorizer.partial_fit_transform(chunk['name'].fillna('')))
+        frames.append(chunk)
+    vectorizer.finish_fit()
+
+    total_match_df = pd.concat(frames, ignore_index=True)
+    can_tfidf = vectorizer.weight(vstack(count_chunks, format='csr'))
+    return total_match_df, vectorizer, can_tfidf
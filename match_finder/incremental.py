@@ -0,0 +1,74 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from match_finder.columnar import read_table, write_table
+
+STATE_DIR = os.path.join("match_finder", "incremental_state")
+RESULT_COLUMNS = ['best_match_name', 'best_match_data_source_id', 'best_match_data_source_cat_id',
+                  'similarity_score']
+
+
+def need_fingerprints(needs_match_df):
+    """64-bit fingerprint of every need row (data source, category id and name)"""
+    return pd.util.hash_pandas_object(needs_match_df[['data_source_id', 'data_source_cat_id', 'name']],
+                                      index=False).to_numpy()
+
+
+def load_previous_results(candidates_key, state_dir=STATE_DIR):
+    """
+    Results of the previous run keyed by need fingerprint, or None when there is no previous
+    run against the same candidates. Any change to the candidate file changes the IDF weights,
+    and so every score, which is why the candidates are compared as a whole.
+    """
+    state_file = os.path.join(state_dir, "state.json")
+    results_file = os.path.join(state_dir, "results.npz")
+    if not os.path.exists(state_file) or not os.path.exists(results_file):
+        print("- Incremental: no previous run found, scoring all needs")
+        return None
+    with open(state_file, 'r') as f:
+        state = json.load(f)
+    if state.get('candidates_key') != candidates_key:
+        print("- Incremental: candidates or vectorizer settings changed, scoring all needs")
+        return None
+    previous = read_table(results_file)
+    return previous.drop_duplicates('fingerprint').set_index('fingerprint')
+
+
+def needs_to_score(fingerprints, previous):
+    """Mask of the needs that are new or changed since the previous run"""
+    if previous is None:
+        return np.ones(len(fingerprints), dtype=bool)
+    return ~np.isin(fingerprints, previous.index.to_numpy())
+
+
+def merge_results(needs_match_df, fingerprints, previous, scored_df, to_score):
+    """Results for all needs in input order: re-used results for unchanged needs, new ones for the rest"""
+    if previous is None:
+        return scored_df
+    reused = previous.loc[fingerprints[~to_score], RESULT_COLUMNS].set_axis(np.flatnonzero(~to_score))
+    scored = scored_df[RESULT_COLUMNS].set_axis(np.flatnonzero(to_score))
+    combined = pd.concat([reused, scored]).sort_index()
+
+    results_df = needs_match_df.copy()
+    for column in RESULT_COLUMNS:
+        results_df[column] = combined[column].to_numpy()
+    return results_df
+
+
+def save_state(results_df, fingerprints, candidates_key, state_dir=STATE_DIR):
+    os.makedirs(state_dir, exist_ok=True)
+    state_df = results_df[RESULT_COLUMNS].copy()
+    state_df.insert(0, 'fingerprint', fingerprints)
+    # state.json is removed before results.npz is replaced and written again last, so an interrupted
+    # save leaves no state (the next run scores all needs) rather than pairing the old candidates key
+    # with results of other candidates
+    state_file = os.path.join(state_dir, "state.json")
+    if os.path.exists(state_file):
+        os.remove(state_file)
+    write_table(state_df, os.path.join(state_dir, "results.npz"))
+    with open(os.path.join(state_dir, "state.json.tmp"), 'w') as f:
+        json.dump({'candidates_key': candidates_key}, f)
+    os.replace(os.path.join(state_dir, "state.json.tmp"), state_file)
@@ -1,79 +1,294 @@
+import argparse
+import numpy as np
 import pandas as pd
 from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
 import os
 import sys
 
-def run_matcher(similarity_threshold=0.60):
+from match_finder.assignment import ASSIGNMENT_MODES, assign
+from match_finder.columnar import CSV_EXTENSION, remove_table, write_stage
+from match_finder.db_source import fit_candidates_from_db, read_categories, stream_categories
+from match_finder.hashing_backend import DEFAULT_HASH_FEATURES, HashedTfidfVectorizer, build_hashed_index
+from match_finder.incremental import load_previous_results, merge_results, need_fingerprints, needs_to_score, \
+    save_state
+from match_finder.parallel import parallel_matches
+from match_finder.pruning import pruned_best_matches
+from match_finder.scoring import best_matches, top_k_matches, DEFAULT_MEMORY_BUDGET_MB
+from match_finder.tfidf_index import VECTORIZER_SETTINGS, dataframe_key, index_key, load_or_build_index
+
+SCORED_MATCHES = os.path.join("match_finder", "scored_matches", "data")
+SUGGESTED_MATCHES = os.path.join("match_finder", "suggested_match", "data")
+LOW_SIMILARITY_MATCHES = os.path.join("match_finder", "similarity_too_low", "data")
+
+def add_candidate_columns(df, total_match_df, can_texts, idx, scores):
+    """Add the best_match_* columns for candidate rows idx; an index of -1 leaves the need unmatched"""
+    columns = {
+        'best_match_name': can_texts,
+        'best_match_data_source_id': total_match_df['data_source_id'],
+        'best_match_data_source_cat_id': total_match_df['data_source_cat_id'],
+    }
+    unmatched = (idx < 0).any()
+    for column, values in columns.items():
+        if unmatched:
+            if column != 'best_match_name':
+                values = values.astype('Int64')
+            df[column] = pd.api.extensions.take(values.array, idx, allow_fill=True)
+        else:
+            df[column] = values.to_numpy()[idx]
+    df['similarity_score'] = scores
+    return df
+
+def write_top_k(needs_match_df, total_match_df, can_texts, top_idx, top_scores):
+    # Long format: one row per (need, candidate) pair, rank 1 being the best candidate
+    n_needs, k = top_idx.shape
+    top_k_df = needs_match_df.iloc[np.repeat(np.arange(n_needs), k)].reset_index(drop=True)
+    top_k_df['rank'] = np.tile(np.arange(1, k + 1), n_needs)
+    add_candidate_columns(top_k_df, total_match_df, can_texts, top_idx.ravel(), top_scores.ravel())
+
+    os.makedirs(os.path.join("match_finder", "top_k_matches"), exist_ok=True)
+    top_k_df.to_csv(os.path.join("match_finder", "top_k_matches", "data.csv"), index=False)
+    print(f"- {len(top_k_df)} top-{k} candidates saved to top_k_matches/data.csv")
+
+def split_by_threshold(results_df, similarity_threshold):
+    good_matches = results_df[results_df['similarity_score'] >= similarity_threshold]
+    low_similarity = results_df[results_df['similarity_score'] < similarity_threshold]
+    return good_matches, low_similarity
+
+def write_results(results_df, similarity_threshold, append=None, export_csv=True):
+    """
+    Write the scored needs and their threshold split as typed tables for the next stages, with CSV
+    copies for review. With append (streaming runs), rows are appended to the CSV files only.
+    """
+    # Keep every scored need so other thresholds can be applied without re-scoring
+    stages = [(SCORED_MATCHES, results_df)]
+
+    # Split results based on similarity threshold
+    good_matches, low_similarity = split_by_threshold(results_df, similarity_threshold)
+    stages += [(SUGGESTED_MATCHES, good_matches), (LOW_SIMILARITY_MATCHES, low_similarity)]
+
+    for stage_base, stage_df in stages:
+        if append is None:
+            write_stage(stage_df, stage_base, export_csv)
+        else:
+            stage_df.to_csv(stage_base + CSV_EXTENSION, index=False, mode='a' if append else 'w', header=not append)
+    return len(good_matches), len(low_similarity)
+
+def print_summary(good_count, low_count):
+    print(f"\nMatching complete:")
+    print(f"- {good_count} matches above threshold saved to suggested_match/")
+    print(f"- {low_count} matches below threshold saved to similarity_too_low/")
+
+def vectorize_candidates(candidates_path, can_texts, use_index_cache=True):
+    # Vectorize using TF-IDF, reusing the stored index for this candidate file when there is one
+    if use_index_cache:
+        return load_or_build_index(candidates_path, can_texts)
+    vectorizer = TfidfVectorizer(**VECTORIZER_SETTINGS)
+    return vectorizer, vectorizer.fit_transform(can_texts), None
+
+def score_best_matches(need_tfidf, can_tfidf, memory_budget_mb=DEFAULT_MEMORY_BUDGET_MB, workers=1,
+                       index_path=None, prune=False, prune_max_df=None):
+    if prune:
+        # Only score candidates sharing a token with the need
+        best_idx, best_scores, pruned_pairs = pruned_best_matches(need_tfidf, can_tfidf, memory_budget_mb,
+                                                                  prune_max_df)
+        total_pairs = need_tfidf.shape[0] * can_tfidf.shape[0]
+        print(f"- Pruned {pruned_pairs:,} of {total_pairs:,} need/candidate pairs "
+              f"({100 * pruned_pairs / max(total_pairs, 1):.1f}%)")
+        return best_idx, best_scores
+    if workers > 1:
+        return parallel_matches(need_tfidf, can_tfidf, workers, index_path, memory_budget_mb=memory_budget_mb)
+    # Score all needs at once and look up the best candidate of each with array indexing
+    return best_matches(need_tfidf, can_tfidf, memory_budget_mb)
+
+def read_needs(needs_path, source_ds=None):
+    if source_ds is not None:
+        return read_categories(source_ds)
+    return pd.read_csv(needs_path, names=['data_source_id', 'data_source_cat_id', 'name'])
+
+def iter_needs_chunks(needs_path, chunk_size, source_ds=None):
+    if source_ds is not None:
+        # Each chunk is one batch of the server-side cursor
+        return stream_categories(source_ds, chunk_size)
+    return pd.read_csv(needs_path, names=['data_source_id', 'data_source_cat_id', 'name'], chunksize=chunk_size)
+
+def run_matcher(similarity_threshold=0.60, memory_budget_mb=DEFAULT_MEMORY_BUDGET_MB, top_k=None,
+                assignment_mode=None, use_index_cache=True, workers=1, prune=False, prune_max_df=None,
+                backend='tfidf', hash_features=DEFAULT_HASH_FEATURES, incremental=False, chunk_size=None,
+                source_ds=None, target_ds=None, export_csv=True):
+    if chunk_size and (top_k or incremental):
+        raise ValueError("chunk_size cannot be combined with top_k or incremental")
     print(f"Using similarity threshold: {similarity_threshold}")
-    
+
     # Read data from folders
-    needs_match_df = pd.read_csv(os.path.join("match_finder", "needs_match", "data.csv"), 
-                                names=['data_source_id', 'data_source_cat_id', 'name'])
-    total_match_df = pd.read_csv(os.path.join("match_finder", "total_match_options", "data.csv"), 
-                                names=['data_source_id', 'data_source_cat_id', 'name'])
+    needs_path = os.path.join("match_finder", "needs_match", "data.csv")
+    candidates_path = os.path.join("match_finder", "total_match_options", "data.csv")
+
+    index_path = None
+    if target_ds is not None:
+        # Candidates are streamed from tpa.categories straight into the vectorizer
+        print(f"Reading candidates for data source {target_ds} from tpa.categories")
+        vectorizer = HashedTfidfVectorizer(hash_features) if backend == 'hashing' \
+            else TfidfVectorizer(**VECTORIZER_SETTINGS)
+        total_match_df, can_tfidf = fit_candidates_from_db(target_ds, vectorizer)
+        can_texts = total_match_df['name'].fillna('')
+    elif backend == 'hashing':
+        # Candidates are read in chunks and vectorized over a fixed-width hashed feature space
+        total_match_df, vectorizer, can_tfidf = build_hashed_index(candidates_path, hash_features)
+        can_texts = total_match_df['name'].fillna('')
+    else:
+        total_match_df = pd.read_csv(candidates_path, names=['data_source_id', 'data_source_cat_id', 'name'])
+        can_texts = total_match_df['name'].fillna('')
+        vectorizer, can_tfidf, index_path = vectorize_candidates(candidates_path, can_texts, use_index_cache)
+
+    if workers > 1:
+        print(f"Scoring with {workers} worker processes")
+
+    if chunk_size:
+        # Needs are scored chunk by chunk and appended to the output files, so memory stays flat
+        # Streaming runs only write CSV files, so tables of earlier runs must not be picked up instead
+        for stage_base in [SCORED_MATCHES, SUGGESTED_MATCHES, LOW_SIMILARITY_MATCHES]:
+            os.makedirs(os.path.dirname(stage_base), exist_ok=True)
+            remove_table(stage_base)
+        good_count = low_count = 0
+        for chunk_number, needs_chunk in enumerate(iter_needs_chunks(needs_path, chunk_size, source_ds)):
+            need_tfidf = vectorizer.transform(needs_chunk['name'].fillna(''))
+            best_idx, best_scores = score_best_matches(need_tfidf, can_tfidf, memory_budget_mb, workers,
+                                                       index_path, prune, prune_max_df)
+            results_df = add_candidate_columns(needs_chunk.copy(), total_match_df, can_texts, best_idx, best_scores)
+            chunk_good, chunk_low = write_results(results_df, similarity_threshold, append=chunk_number > 0)
+            good_count += chunk_good
+            low_count += chunk_low
+            print(f"- Scored {good_count + low_count} needs")
+        print_summary(good_count, low_count)
+        return
+
+    needs_match_df = read_needs(needs_path, source_ds)
 
     # Fill missing values
     needs_texts = needs_match_df['name'].fillna('')
-    can_texts = total_match_df['name'].fillna('')
-
-    # Vectorize using TF-IDF
-    vectorizer = TfidfVectorizer(stop_words='english')
-    can_tfidf = vectorizer.fit_transform(can_texts)
-    can_texts_array = can_texts.values
-
-    # Match each need to the best candidate
-    best_matches = []
-    best_scores = []
-    best_data_source_ids = []
-    best_data_source_cat_ids = []
-
-    for need in needs_texts:
-        need_tfidf = vectorizer.transform([need])
-        sim_scores = cosine_similarity(need_tfidf, can_tfidf).flatten()
-        best_idx = sim_scores.argmax()
-        best_matches.append(can_texts_array[best_idx])
-        best_scores.append(sim_scores[best_idx])
-        best_data_source_ids.append(total_match_df.iloc[best_idx]['data_source_id'])
-        best_data_source_cat_ids.append(total_match_df.iloc[best_idx]['data_source_cat_id'])
-
-    # Create results dataframe
-    results_df = needs_match_df.copy()
-    results_df['best_match_name'] = best_matches
-    results_df['best_match_data_source_id'] = best_data_source_ids
-    results_df['best_match_data_source_cat_id'] = best_data_source_cat_ids
-    results_df['similarity_score'] = best_scores
-    
-    # Split results based on similarity threshold
-    good_matches = results_df[results_df['similarity_score'] >= similarity_threshold]
-    low_similarity = results_df[results_df['similarity_score'] < similarity_threshold]
-    
-    # Save good matches
-    os.makedirs(os.path.join("match_finder", "suggested_match"), exist_ok=True)
-    good_matches.to_csv(os.path.join("match_finder", "suggested_match", "data.csv"), index=False)
-    
-    # Save low similarity matches
-    os.makedirs(os.path.join("match_finder", "similarity_too_low"), exist_ok=True)
-    low_similarity.to_csv(os.path.join("match_finder", "similarity_too_low", "data.csv"), index=False)
 
-    print(f"\nMatching complete:")
-    print(f"- {len(good_matches)} matches above threshold saved to suggested_match/data.csv")
-    print(f"- {len(low_similarity)} matches below threshold saved to similarity_too_low/data.csv")
+    if top_k:
+        # Keep the k best candidates per need; rank 1 is the best match
+        need_tfidf = vectorizer.transform(needs_texts)
+        if workers > 1:
+            top_idx, top_scores = parallel_matches(need_tfidf, can_tfidf, workers, index_path, top_k,
+                                                   memory_budget_mb)
+        else:
+            top_idx, top_scores = top_k_matches(need_tfidf, can_tfidf, top_k, memory_budget_mb)
+        write_top_k(needs_match_df, total_match_df, can_texts, top_idx, top_scores)
+        if assignment_mode:
+            # Each candidate is suggested for at most one need
+            best_idx, best_scores = assign(top_idx, top_scores, assignment_mode)
+            print(f"- {(best_idx >= 0).sum()} needs assigned one-to-one ({assignment_mode})")
+        else:
+            best_idx, best_scores = top_idx[:, 0], top_scores[:, 0]
+        results_df = add_candidate_columns(needs_match_df.copy(), total_match_df, can_texts, best_idx, best_scores)
+    else:
+        to_score = np.ones(len(needs_match_df), dtype=bool)
+        if incremental:
+            # Only needs that are new or changed since the last run against these candidates are scored
+            settings = {'backend': backend, 'hash_features': hash_features} if backend == 'hashing' \
+                else VECTORIZER_SETTINGS
+            if prune and prune_max_df is not None:
+                # Approximate results are never re-used by exact runs, nor the other way round
+                settings = {**settings, 'prune_max_df': prune_max_df}
+            if target_ds is not None:
+                candidates_key = dataframe_key(total_match_df, settings)
+            else:
+                candidates_key = index_key(candidates_path, settings)
+            fingerprints = need_fingerprints(needs_match_df)
+            previous = load_previous_results(candidates_key)
+            to_score = needs_to_score(fingerprints, previous)
+            print(f"- Incremental: scoring {to_score.sum()} new or changed of {len(to_score)} needs")
+
+        if to_score.any():
+            need_tfidf = vectorizer.transform(needs_texts[to_score])
+            best_idx, best_scores = score_best_matches(need_tfidf, can_tfidf, memory_budget_mb, workers,
+                                                       index_path, prune, prune_max_df)
+        else:
+            best_idx, best_scores = np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float64)
+
+        # Create results dataframe
+        results_df = add_candidate_columns(needs_match_df[to_score].copy(), total_match_df, can_texts, best_idx,
+                                           best_scores)
+        if incremental:
+            results_df = merge_results(needs_match_df, fingerprints, previous, results_df, to_score)
+            save_state(results_df, fingerprints, candidates_key)
+
+    good_count, low_count = write_results(results_df, similarity_threshold, export_csv=export_csv)
+    print_summary(good_count, low_count)
 
 def main():
     print("Starting audience segment matching...")
-    # Check if similarity threshold was provided as argument
-    if len(sys.argv) > 1:
-        try:
-            threshold = float(sys.argv[1])
-            if threshold <= 0 or threshold > 1:
-                raise ValueError
-            run_matcher(similarity_threshold=threshold)
-        except ValueError:
-            print("Error: Similarity threshold must be a number between 0 and 1")
-            sys.exit(1)
-    else:
-        run_matcher()
+    parser = argparse.ArgumentParser(description='Find the best matching segment for each segment that needs a match')
+    parser.add_argument('threshold', nargs='?', type=float, default=0.60,
+                        help='Similarity threshold (between 0 and 1, default: 0.60)')
+    parser.add_argument('--top-k', type=int, default=None,
+                        help='Also write the k best candidates per need to top_k_matches/data.csv')
+    parser.add_argument('--assign', choices=ASSIGNMENT_MODES, default=None,
+                        help='Assign candidates one-to-one over the top-k candidates (requires --top-k)')
+    parser.add_argument('--memory-budget-mb', type=float, default=DEFAULT_MEMORY_BUDGET_MB,
+                        help=f'Memory budget for each block of similarity scores (default: {DEFAULT_MEMORY_BUDGET_MB})')
+    parser.add_argument('--no-index-cache', action='store_true',
+                        help='Refit the TF-IDF vectorizer instead of using the stored index in match_finder/tfidf_index')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Number of worker processes to score the needs with (default: 1)')
+    parser.add_argument('--prune', action='store_true',
+                        help='Only score candidates sharing at least one token with the need (same results)')
+    parser.add_argument('--prune-max-df', type=float, default=None,
+                        help='With --prune, only use tokens found in at most this fraction of candidates to '
+                             'select them (faster, approximate)')
+    parser.add_argument('--backend', choices=['tfidf', 'hashing'], default='tfidf',
+                        help='tfidf (default) or hashing: hashed TF-IDF features with memory bounded by '
+                             '--hash-features, for very large candidate taxonomies')
+    parser.add_argument('--hash-features', type=int, default=DEFAULT_HASH_FEATURES,
+                        help=f'Number of hashed features for --backend hashing (default: {DEFAULT_HASH_FEATURES})')
+    parser.add_argument('--incremental', action='store_true',
+                        help='Only score needs that are new or changed since the last --incremental run')
+    parser.add_argument('--chunk-size', type=int, default=None,
+                        help='Read and score the needs in chunks of this many rows, appending to the output files')
+    parser.add_argument('--source-ds', type=int, default=None,
+                        help='Read the segments that need a match from tpa.categories for this data source id '
+                             'instead of needs_match/data.csv')
+    parser.add_argument('--target-ds', type=int, default=None,
+                        help='Read the candidate segments from tpa.categories for this data source id '
+                             'instead of total_match_options/data.csv')
+    parser.add_argument('--no-csv', action='store_true',
+                        help='Only write the typed .npz tables read by the next stages, not the CSV copies '
+                             '(streaming runs with --chunk-size always write CSV)')
+
+    args = parser.parse_args()
+    if args.threshold <= 0 or args.threshold > 1:
+        print("Error: Similarity threshold must be a number between 0 and 1")
+        sys.exit(1)
+    if args.top_k is not None and args.top_k < 1:
+        print("Error: --top-k must be at least 1")
+        sys.exit(1)
+    if args.workers < 1:
+        print("Error: --workers must be at least 1")
+        sys.exit(1)
+    if args.prune_max_df is not None and not args.prune:
+        print("Error: --prune-max-df requires --prune")
+        sys.exit(1)
+    if args.prune and (args.top_k or args.workers > 1):
+        print("Error: --prune cannot be combined with --top-k or --workers")
+        sys.exit(1)
+    if args.chunk_size is not None and (args.chunk_size < 1 or args.top_k or args.incremental):
+        print("Error: --chunk-size must be at least 1 and cannot be combined with --top-k or --incremental")
+        sys.exit(1)
+    if args.incremental and args.top_k:
+        print("Error: --incremental cannot be combined with --top-k")
+        sys.exit(1)
+    if args.assign and not args.top_k:
+        print("Error: --assign requires --top-k")
+        sys.exit(1)
+
+    run_matcher(similarity_threshold=args.threshold, memory_budget_mb=args.memory_budget_mb,
+                top_k=args.top_k, assignment_mode=args.assign, use_index_cache=not args.no_index_cache,
+                workers=args.workers, prune=args.prune, prune_max_df=args.prune_max_df,
+                backend=args.backend, hash_features=args.hash_features, incremental=args.incremental,
+                chunk_size=args.chunk_size, source_ds=args.source_ds, target_ds=args.target_ds,
+                export_csv=not args.no_csv)
 
 if __name__ == "__main__":
     main()
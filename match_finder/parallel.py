@@ -0,0 +1,92 @@
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from match_finder.scoring import best_matches, top_k_matches, candidate_scoring_matrix, DEFAULT_MEMORY_BUDGET_MB
+from match_finder.tfidf_index import load_matrix, save_matrix
+
+# Shards per worker, so a slow shard does not leave the other workers idle
+SHARDS_PER_WORKER = 4
+
+# Subdirectory of the candidate matrix entry holding its prepared scoring matrix
+SCORING_MATRIX_DIR = "scoring"
+
+# Candidate matrices of the current worker process, set once by _init_worker
+_worker_can_tfidf = None
+_worker_can_scoring = None
+
+
+def _init_worker(entry_path, scoring_path):
+    # Every worker memory-maps the same on-disk candidate matrices instead of receiving pickled copies
+    global _worker_can_tfidf, _worker_can_scoring
+    _worker_can_tfidf = load_matrix(entry_path)
+    _worker_can_scoring = load_matrix(scoring_path)
+
+
+def save_scoring_matrix(can_tfidf, entry_path):
+    """
+    Write the candidate_scoring_matrix of can_tfidf next to it in entry_path, unless an earlier run
+    already did, so it is prepared once rather than once per worker.
+    :return: directory of the scoring matrix, to be read with load_matrix
+    """
+    scoring_path = os.path.join(entry_path, SCORING_MATRIX_DIR)
+    if os.path.isdir(scoring_path):
+        return scoring_path
+    # Written to a temporary directory first so concurrent runs never see a partial matrix
+    tmp_path = tempfile.mkdtemp(prefix='.', dir=entry_path)
+    try:
+        save_matrix(candidate_scoring_matrix(can_tfidf), tmp_path)
+        os.rename(tmp_path, scoring_path)
+    except OSError:
+        # Another run stored it first
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        if not os.path.isdir(scoring_path):
+            raise
+    return scoring_path
+
+
+def _score_shard(shard):
+    need_shard, top_k, memory_budget_mb = shard
+    if top_k:
+        return top_k_matches(need_shard, _worker_can_tfidf, top_k, memory_budget_mb, _worker_can_scoring)
+    return best_matches(need_shard, _worker_can_tfidf, memory_budget_mb, _worker_can_scoring)
+
+
+def parallel_matches(need_tfidf, can_tfidf, workers, entry_path=None, top_k=None,
+                     memory_budget_mb=DEFAULT_MEMORY_BUDGET_MB):
+    """
+    Score the needs across a pool of worker processes.
+    The needs are split into contiguous shards and the shard results are concatenated in
+    input order, so the output is identical to scoring in a single process.
+    :param entry_path: directory holding the candidate matrix written by save_matrix, e.g. the
+                       TF-IDF index entry; when None the matrix is written to a temporary directory
+    :return: (idx, scores) as returned by best_matches, or by top_k_matches when top_k is set
+    """
+    tmp_path = None
+    if entry_path is None:
+        tmp_path = tempfile.mkdtemp(prefix='match_finder_')
+        save_matrix(can_tfidf, tmp_path)
+        entry_path = tmp_path
+
+    try:
+        scoring_path = save_scoring_matrix(can_tfidf, entry_path)
+        n_needs = need_tfidf.shape[0]
+        n_shards = max(1, min(n_needs, workers * SHARDS_PER_WORKER))
+        bounds = np.linspace(0, n_needs, n_shards + 1).astype(int)
+        # The memory budget is shared by all workers
+        shard_budget = memory_budget_mb / workers
+        shards = [(need_tfidf[start:stop], top_k, shard_budget) for start, stop in zip(bounds[:-1], bounds[1:])]
+
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(entry_path, scoring_path)) as pool:
+            # map returns shard results in submission order
+            results = list(pool.map(_score_shard, shards))
+    finally:
+        if tmp_path is not None:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+    idx = np.concatenate([shard_idx for shard_idx, _ in results])
+    scores = np.concatenate([shard_scores for _, shard_scores in results])
+    return idx, scores
@@ -0,0 +1,95 @@
+import numpy as np
+from scipy.sparse import csr_matrix
+from sklearn.preprocessing import normalize
+
+from match_finder.scoring import candidate_scoring_matrix, rows_per_block, DEFAULT_MEMORY_BUDGET_MB
+
+
+def build_inverted_index(can_tfidf):
+    """
+    Inverted index over the fitted vocabulary: row t lists the candidate rows containing token t
+    together with their (normalised) weights. Multiplying need rows with it only touches the
+    candidates that share at least one token with the need.
+    """
+    return candidate_scoring_matrix(can_tfidf)
+
+
+def sparse_row_argmax(scores):
+    """
+    Best column and score of every row of a sparse score matrix. Rows without stored scores get
+    column 0 and a score of 0, and ties go to the lowest column, exactly like argmax over the
+    dense rows would.
+    """
+    scores = scores.tocsr()
+    scores.sort_indices()
+    n_rows = scores.shape[0]
+    best_idx = np.zeros(n_rows, dtype=np.int64)
+    best_scores = np.zeros(n_rows, dtype=np.float64)
+
+    row_lengths = np.diff(scores.indptr)
+    scored_rows = np.flatnonzero(row_lengths)
+    if len(scored_rows) == 0:
+        return best_idx, best_scores
+
+    row_max = np.maximum.reduceat(scores.data, scores.indptr[scored_rows])
+    best_scores[scored_rows] = row_max
+    # First stored entry of each row equal to its maximum; indices are sorted, so lowest column
+    entry_rows = np.repeat(np.arange(n_rows), row_lengths)
+    max_entries = np.flatnonzero(scores.data == best_scores[entry_rows])
+    _, first = np.unique(entry_rows[max_entries], return_index=True)
+    best_idx[scored_rows] = scores.indices[max_entries[first]]
+    return best_idx, best_scores
+
+
+def _rare_token_scores(need_block, can_normalized, inverted_index, rare_tokens):
+    # Candidates are selected through rare tokens only (or all tokens for needs without any), then
+    # the selected pairs are scored exactly
+    has_rare = np.asarray(need_block[:, rare_tokens].sum(axis=1)).ravel() > 0
+    selector = need_block.copy()
+    selector.data[:] = 1.0
+    rare_mask = np.zeros(need_block.shape[1], dtype=bool)
+    rare_mask[rare_tokens] = True
+    token_mask = rare_mask[selector.indices] | ~np.repeat(has_rare, np.diff(selector.indptr))
+    selector.data[~token_mask] = 0.0
+    selector.eliminate_zeros()
+    pairs = (selector @ inverted_index).tocoo()
+
+    pair_scores = np.asarray(need_block[pairs.row].multiply(can_normalized[pairs.col]).sum(axis=1)).ravel()
+    return csr_matrix((pair_scores, (pairs.row, pairs.col)), shape=pairs.shape)
+
+
+def pruned_best_matches(need_tfidf, can_tfidf, memory_budget_mb=DEFAULT_MEMORY_BUDGET_MB, max_df=None):
+    """
+    Best candidate for every need, scoring only the candidates that share a token with the need.
+    Gives the same result as best_matches.
+    :param max_df: when set, candidates are only found through tokens that occur in at most this
+                   fraction of candidates. Faster on very common tokens, but approximate: a best
+                   candidate sharing only common tokens with the need is missed.
+    :return: (best_idx, best_scores, pruned_pairs)
+    """
+    n_needs, n_candidates = need_tfidf.shape[0], can_tfidf.shape[0]
+    inverted_index = build_inverted_index(can_tfidf)
+
+    rare_tokens = None
+    if max_df is not None:
+        document_frequency = np.diff(inverted_index.indptr)
+        rare_tokens = np.flatnonzero(document_frequency <= max_df * n_candidates)
+        can_normalized = normalize(can_tfidf).tocsr()
+
+    best_idx = np.zeros(n_needs, dtype=np.int64)
+    best_scores = np.zeros(n_needs, dtype=np.float64)
+    scored_pairs = 0
+    block_size = rows_per_block(n_candidates, memory_budget_mb)
+    for start in range(0, n_needs, block_size):
+        stop = min(start + block_size, n_needs)
+        need_block = normalize(need_tfidf[start:stop])
+        if rare_tokens is None:
+            # Stays sparse: only need/candidate pairs sharing a token are ever computed
+            scores = need_block @ inverted_index
+        else:
+            scores = _rare_token_scores(need_block, can_normalized, inverted_index, rare_tokens)
+        scored_pairs += scores.nnz
+        best_idx[start:stop], best_scores[start:stop] = sparse_row_argmax(scores)
+
+    pruned_pairs = n_needs * n_candidates - scored_pairs
+    return best_idx, best_scores, pruned_pairs
@@ -0,0 +1,75 @@
+import numpy as np
+from sklearn.preprocessing import normalize
+
+# Upper bound for the dense similarity block held in memory at any one time
+DEFAULT_MEMORY_BUDGET_MB = 256
+
+
+def rows_per_block(n_candidates, memory_budget_mb=DEFAULT_MEMORY_BUDGET_MB):
+    """Number of need rows whose dense score block fits in the memory budget"""
+    bytes_per_row = max(n_candidates, 1) * np.dtype(np.float64).itemsize
+    return max(1, int(memory_budget_mb * 1024 * 1024 // bytes_per_row))
+
+
+def candidate_scoring_matrix(can_tfidf):
+    """
+    Candidate matrix prepared for scoring: rows normalised and transposed so need rows can be
+    multiplied with it directly.
+    TF-IDF rows are already L2-normalised, so cosine similarity is a plain sparse dot product.
+    The rows are normalised once more (an O(nnz) pass) so scores match sklearn's cosine_similarity
+    to the last bit.
+    """
+    return normalize(can_tfidf).T.tocsr()
+
+
+def iter_score_blocks(need_tfidf, can_tfidf, memory_budget_mb=DEFAULT_MEMORY_BUDGET_MB, can_scoring=None):
+    """
+    Yield (start_row, scores) for consecutive blocks of needs, where scores is a dense
+    (block_rows x n_candidates) array of cosine similarities.
+    can_scoring may be passed in when candidate_scoring_matrix was already computed.
+    """
+    if can_scoring is None:
+        can_scoring = candidate_scoring_matrix(can_tfidf)
+    block_size = rows_per_block(can_scoring.shape[1], memory_budget_mb)
+    for start in range(0, need_tfidf.shape[0], block_size):
+        stop = min(start + block_size, need_tfidf.shape[0])
+        yield start, (normalize(need_tfidf[start:stop]) @ can_scoring).toarray()
+
+
+def best_matches(need_tfidf, can_tfidf, memory_budget_mb=DEFAULT_MEMORY_BUDGET_MB, can_scoring=None):
+    """
+    Find the best candidate for every need.
+    :return: (best_idx, best_scores) arrays with one entry per need row
+    """
+    n_needs = need_tfidf.shape[0]
+    best_idx = np.zeros(n_needs, dtype=np.int64)
+    best_scores = np.zeros(n_needs, dtype=np.float64)
+    for start, scores in iter_score_blocks(need_tfidf, can_tfidf, memory_budget_mb, can_scoring):
+        stop = start + scores.shape[0]
+        best_idx[start:stop] = scores.argmax(axis=1)
+        best_scores[start:stop] = scores[np.arange(scores.shape[0]), best_idx[start:stop]]
+    return best_idx, best_scores
+
+
+def top_k_matches(need_tfidf, can_tfidf, k, memory_budget_mb=DEFAULT_MEMORY_BUDGET_MB, can_scoring=None):
+    """
+    Find the k best candidates for every need with a partial sort of each score block.
+    Candidates of a need are ordered by descending score, ties by candidate row.
+    :return: (top_idx, top_scores) arrays of shape (n_needs, min(k, n_candidates))
+    """
+    n_needs = need_tfidf.shape[0]
+    k = min(k, can_tfidf.shape[0])
+    top_idx = np.zeros((n_needs, k), dtype=np.int64)
+    top_scores = np.zeros((n_needs, k), dtype=np.float64)
+    for start, scores in iter_score_blocks(need_tfidf, can_tfidf, memory_budget_mb, can_scoring):
+        stop = start + scores.shape[0]
+        if k < scores.shape[1]:
+            block_idx = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        else:
+            block_idx = np.tile(np.arange(scores.shape[1]), (scores.shape[0], 1))
+        block_scores = np.take_along_axis(scores, block_idx, axis=1)
+        # Only the k kept columns are sorted
+        order = np.lexsort((block_idx, -block_scores), axis=1)
+        top_idx[start:stop] = np.take_along_axis(block_idx, order, axis=1)
+        top_scores[start:stop] = np.take_along_axis(block_scores, order, axis=1)
+    return top_idx, top_scores
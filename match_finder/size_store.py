@@ -0,0 +1,87 @@
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+MANIFEST_FILE = "manifest.json"
+
+
+def category_arrays(counts):
+    """
+    Sorted int64 category ids and their int64 counts from one data source's {cat_id: count} dict.
+    Categories that are not plain integers cannot match a category id and are left out.
+    """
+    ids = pd.Series(list(counts.keys()), dtype=object).astype(str)
+    values = pd.to_numeric(pd.Series(list(counts.values()), dtype=object), errors='coerce')
+    valid = (ids.str.fullmatch(r'-?\d+') & values.notna()).to_numpy()
+    cat_ids = ids[valid].astype(np.int64).to_numpy()
+    values = values[valid].astype(np.int64).to_numpy()
+    order = np.argsort(cat_ids, kind='stable')
+    return cat_ids[order], values[order]
+
+
+class SizeStoreWriter:
+    """
+    Writes a size store one data source at a time: <ds>.cat_ids.npy and <ds>.counts.npy per data
+    source plus a manifest. Files go to a temporary directory that commit() renames into place.
+    """
+
+    def __init__(self, parent_dir, name):
+        os.makedirs(parent_dir, exist_ok=True)
+        self.store_path = os.path.join(parent_dir, name)
+        self.tmp_path = tempfile.mkdtemp(prefix='.', dir=parent_dir)
+        self.data_sources = {}
+
+    def add(self, data_source_id, counts):
+        cat_ids, values = category_arrays(counts or {})
+        np.save(os.path.join(self.tmp_path, f"{int(data_source_id)}.cat_ids.npy"), cat_ids)
+        np.save(os.path.join(self.tmp_path, f"{int(data_source_id)}.counts.npy"), values)
+        self.data_sources[int(data_source_id)] = len(cat_ids)
+
+    def commit(self):
+        with open(os.path.join(self.tmp_path, MANIFEST_FILE), 'w') as f:
+            json.dump({'data_sources': {str(ds): n for ds, n in self.data_sources.items()}}, f)
+        os.rename(self.tmp_path, self.store_path)
+        return self.store_path
+
+    def abort(self):
+        shutil.rmtree(self.tmp_path, ignore_errors=True)
+
+
+class SizeStore:
+    """Memory-mapped category counts of every data source, looked up with binary search"""
+
+    def __init__(self, store_path):
+        self.store_path = store_path
+        with open(os.path.join(store_path, MANIFEST_FILE), 'r') as f:
+            manifest = json.load(f)
+        self.data_sources = {int(ds): n for ds, n in manifest['data_sources'].items()}
+        self._arrays = {}
+
+    def __len__(self):
+        return sum(self.data_sources.values())
+
+    def arrays(self, data_source_id):
+        """(sorted cat_ids, counts) of a data source, memory-mapped on first use"""
+        if data_source_id not in self._arrays:
+            self._arrays[data_source_id] = tuple(
+                np.load(os.path.join(self.store_path, f"{data_source_id}.{part}.npy"), mmap_mode='r')
+                for part in ['cat_ids', 'counts'])
+        return self._arrays[data_source_id]
+
+    def lookup(self, data_source_id, cat_ids):
+        """Counts of int64 cat_ids in one data source, 0 for categories without a count"""
+        result = np.zeros(len(cat_ids), dtype=np.int64)
+        if data_source_id not in self.data_sources or len(cat_ids) == 0:
+            return result
+        store_ids, store_counts = self.arrays(data_source_id)
+        if len(store_ids) == 0:
+            return result
+        positions = np.searchsorted(store_ids, cat_ids)
+        positions[positions == len(store_ids)] = 0
+        found = store_ids[positions] == cat_ids
+        result[found] = store_counts[positions[found]]
+        return result
@@ -0,0 +1,114 @@
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+import sklearn
+from scipy.sparse import csr_matrix
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+# Settings of the TF-IDF vectorizer fitted on the candidate segments
+VECTORIZER_SETTINGS = {'stop_words': 'english'}
+
+INDEX_DIR = os.path.join("match_finder", "tfidf_index")
+# Entries not used for this long, or beyond the most recently used ones, are evicted
+MAX_INDEX_AGE_DAYS = 14
+MAX_INDEX_ENTRIES = 5
+
+MATRIX_PARTS = ['data', 'indices', 'indptr']
+
+
+def index_key(candidates_path, settings=VECTORIZER_SETTINGS):
+    """Content hash of the candidate file, the vectorizer settings and the sklearn version"""
+    digest = hashlib.sha256()
+    with open(candidates_path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    digest.update(json.dumps(settings, sort_keys=True).encode('utf-8'))
+    digest.update(sklearn.__version__.encode('utf-8'))
+    return digest.hexdigest()[:32]
+
+
+def dataframe_key(df, settings=VECTORIZER_SETTINGS):
+    """Same as index_key, for candidates that were not read from a file"""
+    digest = hashlib.sha256()
+    digest.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    digest.update(json.dumps(settings, sort_keys=True).encode('utf-8'))
+    digest.update(sklearn.__version__.encode('utf-8'))
+    return digest.hexdigest()[:32]
+
+
+def save_matrix(matrix, entry_path):
+    # Raw .npy parts (rather than a single .npz) so the matrix can be memory-mapped on load
+    matrix = matrix.tocsr()
+    for part in MATRIX_PARTS:
+        np.save(os.path.join(entry_path, f"{part}.npy"), getattr(matrix, part))
+    with open(os.path.join(entry_path, "meta.json"), 'w') as f:
+        json.dump({'shape': list(matrix.shape), 'created': time.time()}, f)
+
+
+def load_matrix(entry_path, mmap_mode='r'):
+    with open(os.path.join(entry_path, "meta.json"), 'r') as f:
+        shape = tuple(json.load(f)['shape'])
+    parts = [np.load(os.path.join(entry_path, f"{part}.npy"), mmap_mode=mmap_mode) for part in MATRIX_PARTS]
+    return csr_matrix(tuple(parts), shape=shape, copy=False)
+
+
+def evict_stale_entries(index_dir=INDEX_DIR, keep=None):
+    if not os.path.isdir(index_dir):
+        return
+    entries = []
+    for key in os.listdir(index_dir):
+        entry_path = os.path.join(index_dir, key)
+        if os.path.isdir(entry_path) and not key.startswith('.'):
+            entries.append((os.path.getmtime(entry_path), key, entry_path))
+    entries.sort(reverse=True)
+    oldest_allowed = time.time() - MAX_INDEX_AGE_DAYS * 24 * 60 * 60
+    for position, (last_used, key, entry_path) in enumerate(entries):
+        if key == keep:
+            continue
+        if position >= MAX_INDEX_ENTRIES or last_used < oldest_allowed:
+            shutil.rmtree(entry_path, ignore_errors=True)
+            print(f"Evicted stale TF-IDF index {key}")
+
+
+def load_or_build_index(candidates_path, can_texts, index_dir=INDEX_DIR):
+    """
+    Load the fitted vectorizer and candidate TF-IDF matrix for this candidate file, fitting and
+    storing them first if no index exists for the file's current contents.
+    :return: (vectorizer, can_tfidf, entry_path) - the matrix is memory-mapped from entry_path
+    """
+    key = index_key(candidates_path)
+    entry_path = os.path.join(index_dir, key)
+    if os.path.isdir(entry_path):
+        print(f"Loading TF-IDF index {key}")
+        with open(os.path.join(entry_path, "vectorizer.pkl"), 'rb') as f:
+            vectorizer = pickle.load(f)
+        # Mark the entry as recently used
+        os.utime(entry_path)
+        return vectorizer, load_matrix(entry_path), entry_path
+
+    print(f"Building TF-IDF index {key}")
+    vectorizer = TfidfVectorizer(**VECTORIZER_SETTINGS)
+    can_tfidf = vectorizer.fit_transform(can_texts)
+
+    # Write to a temporary directory first so concurrent runs never see a partial entry
+    os.makedirs(index_dir, exist_ok=True)
+    tmp_path = tempfile.mkdtemp(prefix='.', dir=index_dir)
+    try:
+        with open(os.path.join(tmp_path, "vectorizer.pkl"), 'wb') as f:
+            pickle.dump(vectorizer, f, protocol=pickle.HIGHEST_PROTOCOL)
+        save_matrix(can_tfidf, tmp_path)
+        os.rename(tmp_path, entry_path)
+    except OSError:
+        # Another run stored the same entry first
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        if not os.path.isdir(entry_path):
+            raise
+    evict_stale_entries(index_dir, keep=key)
+    return vectorizer, load_matrix(entry_path), entry_path
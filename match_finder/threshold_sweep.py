@@ -0,0 +1,82 @@
+import argparse
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+from match_finder.columnar import read_stage, stage_paths
+from match_finder.matcher import SCORED_MATCHES, main as matcher_main, split_by_threshold
+
+SWEEP_DIR = os.path.join("match_finder", "threshold_sweep")
+
+def scores_are_stale(stage_base=SCORED_MATCHES):
+    # Scores are stale when they are missing or older than either input file
+    written = [os.path.getmtime(path) for path in stage_paths(stage_base) if os.path.exists(path)]
+    if not written:
+        return True
+    inputs = [os.path.join("match_finder", "needs_match", "data.csv"),
+              os.path.join("match_finder", "total_match_options", "data.csv")]
+    return any(os.path.exists(f) and os.path.getmtime(f) > max(written) for f in inputs)
+
+def read_scored_matches(stage_base=SCORED_MATCHES):
+    # Typed table when there is one; the CSV fallback keeps empty candidate ids and exact scores
+    return read_stage(stage_base)
+
+def sweep_thresholds(results_df, thresholds, bins=20):
+    os.makedirs(SWEEP_DIR, exist_ok=True)
+    scores = results_df['similarity_score'].to_numpy()
+
+    # Score histogram; float error can put exact duplicates just above 1.0, outside the top bin
+    bin_counts, bin_edges = np.histogram(np.clip(scores, 0.0, 1.0), bins=bins, range=(0.0, 1.0))
+    bin_edges = bin_edges.round(6)
+    histogram_df = pd.DataFrame({'bin_start': bin_edges[:-1], 'bin_end': bin_edges[1:], 'count': bin_counts})
+    histogram_df.to_csv(os.path.join(SWEEP_DIR, "histogram.csv"), index=False)
+
+    # Counts above/below every threshold from one sort of the scores
+    sorted_scores = np.sort(scores)
+    below = np.searchsorted(sorted_scores, thresholds, side='left')
+    counts_df = pd.DataFrame({'threshold': thresholds, 'suggested_match': len(scores) - below,
+                              'similarity_too_low': below})
+    counts_df.to_csv(os.path.join(SWEEP_DIR, "counts.csv"), index=False)
+
+    # Split files for every threshold
+    for threshold in thresholds:
+        threshold_dir = os.path.join(SWEEP_DIR, format(threshold, 'g'))
+        os.makedirs(threshold_dir, exist_ok=True)
+        good_matches, low_similarity = split_by_threshold(results_df, threshold)
+        good_matches.to_csv(os.path.join(threshold_dir, "suggested_match.csv"), index=False)
+        low_similarity.to_csv(os.path.join(threshold_dir, "similarity_too_low.csv"), index=False)
+
+    print(f"\nThreshold sweep over {len(scores)} scored needs saved to {SWEEP_DIR}:")
+    for row in counts_df.itertuples(index=False):
+        print(f"- {format(row.threshold, 'g')}: {row.suggested_match} suggested, {row.similarity_too_low} too low")
+    return counts_df
+
+def main():
+    parser = argparse.ArgumentParser(description='Split scored matches at several similarity thresholds')
+    parser.add_argument('thresholds', nargs='+', type=float,
+                        help='Similarity thresholds (between 0 and 1) to split the matches at')
+    parser.add_argument('--bins', type=int, default=20, help='Number of score histogram bins (default: 20)')
+    parser.add_argument('--rescore', action='store_true',
+                        help='Run the matcher first even if the scored matches are up to date')
+
+    # Any other options (e.g. --top-k) are passed through to the matcher when it runs
+    args, matcher_args = parser.parse_known_args()
+    thresholds = sorted(set(args.thresholds))
+    if thresholds[0] <= 0 or thresholds[-1] > 1:
+        print("Error: Similarity thresholds must be numbers between 0 and 1")
+        return 1
+
+    if args.rescore or scores_are_stale():
+        sys.argv = [sys.argv[0]] + [str(thresholds[0])] + matcher_args
+        if matcher_main() == 1:
+            return 1
+    else:
+        print(f"Reusing scores from {os.path.dirname(SCORED_MATCHES)} (pass --rescore to run the matcher again)")
+
+    sweep_thresholds(read_scored_matches(), thresholds, args.bins)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
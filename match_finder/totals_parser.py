@@ -0,0 +1,127 @@
+import codecs
+import json
+import re
+
+# Structural tokens of a JSON text: complete strings, an unterminated string (more input is
+# needed), brackets and separators
+TOKEN = re.compile(r'"(?:[^"\\]|\\.)*"|"|[{}\[\]:,]')
+# Inside a data source only brackets matter: numbers, separators and strings without brackets or
+# escapes (all category ids) are skipped within the regex. Without a token, all input was skipped.
+NESTED_TOKEN = re.compile(r'(?:[^"{}\[\]]+|"[^"\\{}\[\]]*")*(?P<token>"(?:[^"\\]|\\.)*"|"|[{}\[\]])?')
+
+COUNTS_KEY = 'data_source_counts'
+
+
+class TotalsParser:
+    """
+    Incremental parser of the /totals response: feed() it text as it arrives and it returns the
+    (data_source_id, value) pairs of "data_source_counts" completed so far. Only the data source
+    being received is kept in memory.
+    The buffer only holds the text of the current feed() and the unscanned rest of the previous one;
+    scanned text of a data source spanning several feeds is kept in value_parts and joined once the
+    data source is complete, so parsing stays linear in the response size.
+    """
+
+    def __init__(self):
+        self.buffer = ''
+        self.value_parts = []
+        self.position = 0
+        self.depth = 0
+        self.key = None
+        self.expect_key = False
+        self.in_counts = False
+        self.value_start = None
+        # The data source being received is a scalar (a number, string, true, false or null) rather
+        # than an object or array; it ends at the next ',' or '}' of data_source_counts
+        self.scalar_value = False
+        self.decoder = json.JSONDecoder()
+
+    def feed(self, text):
+        self.buffer += text
+        completed = []
+        while True:
+            if self.depth > 2:
+                skipped = NESTED_TOKEN.match(self.buffer, self.position)
+                if skipped.group('token') is None:
+                    self.position = skipped.end()
+                    break
+                token, start = skipped.group('token'), skipped.start('token')
+            else:
+                match = TOKEN.search(self.buffer, self.position)
+                if match is None:
+                    break
+                token, start = match.group(), match.start()
+            if token == '"':
+                # Wait for the rest of the string
+                self.position = start
+                break
+            self.position = start + len(token)
+            self._handle(token, start, completed)
+
+        # Everything before the scan position has been handled; the scanned part of the data source
+        # being received is set aside until it is complete
+        if self.value_start is not None:
+            self.value_parts.append(self.buffer[self.value_start:self.position])
+            self.value_start = 0
+        self.buffer = self.buffer[self.position:]
+        self.position = 0
+        return completed
+
+    def _handle(self, token, start, completed):
+        if token[0] == '"':
+            if self.depth <= 2 and self.expect_key:
+                self.key = json.loads(token)
+                self.expect_key = False
+        elif token in '{[':
+            self.depth += 1
+            if self.depth == 2 and self.key == COUNTS_KEY and token == '{':
+                self.in_counts = True
+            elif self.depth == 3 and self.in_counts:
+                self.value_start = start
+                self.scalar_value = False
+            self.expect_key = token == '{'
+        elif token in '}]':
+            if self.scalar_value:
+                self._complete_scalar(start, completed)
+            self.depth -= 1
+            if self.depth == 2 and self.value_start is not None:
+                self.value_parts.append(self.buffer[self.value_start:start + 1])
+                value, _ = self.decoder.raw_decode(''.join(self.value_parts))
+                completed.append((self.key, value))
+                self.value_parts = []
+                self.value_start = None
+            elif self.depth == 1:
+                self.in_counts = False
+        elif token == ':':
+            if self.depth == 2 and self.in_counts:
+                # Where the value of the data source starts, unless it turns out to be an object or array
+                self.value_start = start + 1
+                self.scalar_value = True
+        elif token == ',':
+            # Only seen at depth 1 and 2, where the next member starts with a key
+            if self.scalar_value:
+                self._complete_scalar(start, completed)
+            self.expect_key = True
+
+    def _complete_scalar(self, end, completed):
+        self.value_parts.append(self.buffer[self.value_start:end])
+        completed.append((self.key, json.loads(''.join(self.value_parts))))
+        self.value_parts = []
+        self.value_start = None
+        self.scalar_value = False
+
+
+def iter_text(byte_chunks):
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    for chunk in byte_chunks:
+        yield decoder.decode(chunk)
+    yield decoder.decode(b'', final=True)
+
+
+def iter_data_source_counts(byte_chunks):
+    """(data_source_id, value) of every data source of a /totals response, as it is received"""
+    parser = TotalsParser()
+    for text in iter_text(byte_chunks):
+        yield from parser.feed(text)
+    if parser.depth != 0 or parser.buffer[parser.position:].strip():
+        raise ValueError("Incomplete /totals response")
@@ -1,12 +1,19 @@
 from python.utils.config import config
-from python.utils.db_util import execute_fetch_all_query
+from python.utils.db_util import execute_fetch_all_query, execute_fetch_all_with_vars_query
 from python.utils.request_util import send
+from python.utils.update_executor import AdaptiveRateController, DEFAULT_MAX_CONCURRENCY, DEFAULT_MAX_RATE
 
 audience_service_qa_config = config('../config.ini', 'audience_service_qa')
 audience_service_prod_config = config('../config.ini', 'audience_service_prod')
 audience_service_path_config = config('../config.ini', 'audience_service_path_urls')
 env = config('../config.ini', 'environment')['env']
 
+# Seconds to wait for audience-service before an update counts as timed out
+UPDATE_TIMEOUT_SECONDS = 30
+
+# Paces every audience-service update of the process
+_update_rate_controller = None
+
 def get_audience_service_config():
     if env == 'qa':
         return audience_service_qa_config
@@ -40,6 +47,81 @@ def get_audience_expressions_for_active_campaign_groups(data_source_id):
     """)
 
 
+def get_audience_expressions_with_categories(data_source_category_ids, whole_data_source_ids=(),
+                                             active_campaign_groups_only=False):
+    """
+    Audiences whose expression references at least one of the given categories, or any category of
+    the whole data sources.
+    :param data_source_category_ids: (data_source_id, data_source_category_id) pairs
+    :param whole_data_source_ids: data sources all categories of which are looked for
+    The expressions are parsed server-side and joined with the categories, so audiences that only
+    reference other categories are never returned and every audience is returned once.
+    """
+    data_source_category_ids = list(data_source_category_ids)
+    whole_data_source_ids = list(whole_data_source_ids)
+    data_source_ids = sorted({data_source_id for data_source_id, _ in data_source_category_ids}
+                             | set(whole_data_source_ids))
+    active_campaign_groups_filter = """
+        and exists (
+            select 1
+            from audience.audience_x_campaign_groups cg
+            inner join audience.active_campaign_groups ac using (campaign_group_id)
+            where cg.audience_id = a.audience_id
+        )""" if active_campaign_groups_only else ""
+    return execute_fetch_all_with_vars_query(f"""
+    with mapped_categories (data_source_id, data_source_category_id) as (
+        select * from unnest(%(mapped_data_source_ids)s::int[], %(mapped_data_source_category_ids)s::bigint[])
+    ),
+    candidates as (
+        select a.audience_id, a.expression, a.advertiser_id
+        from audience.audiences a
+        where expression_type_id = 2
+        and expression ~ ('"data_source_id":\\s*(' || array_to_string(%(data_source_ids)s::int[], '|') || ')\\s*[,}}]'){active_campaign_groups_filter}
+    ),
+    conditions as (
+        -- Ids that are not integers (malformed expressions) match nothing instead of failing the cast
+        select c.audience_id, condition,
+            case when condition ->> 'data_source_id' ~ '^\\d{{1,9}}$'
+                then (condition ->> 'data_source_id')::int end data_source_id
+        from candidates c
+        cross join lateral jsonb_path_query(c.expression::jsonb, '$.** ? (exists (@.data_source_id))') condition
+    ),
+    referencing as (
+        select co.audience_id
+        from conditions co
+        cross join lateral jsonb_array_elements(
+            case when jsonb_typeof(co.condition -> 'cats') = 'array' then co.condition -> 'cats' else '[]'::jsonb end) cat
+        inner join mapped_categories m
+            on m.data_source_id = co.data_source_id
+            and m.data_source_category_id = case when cat #>> '{{}}' ~ '^\\d{{1,18}}$' then (cat #>> '{{}}')::bigint end
+        union
+        select co.audience_id
+        from conditions co
+        where co.data_source_id = any(%(whole_data_source_ids)s::int[])
+    )
+    select c.audience_id, c.expression, adv.advertiser_id, adv.company_name
+    from candidates c
+    inner join referencing r using (audience_id)
+    inner join public.advertisers adv using (advertiser_id)
+    order by c.audience_id desc
+    """, {'data_source_ids': data_source_ids,
+          'mapped_data_source_ids': [data_source_id for data_source_id, _ in data_source_category_ids],
+          'mapped_data_source_category_ids': [cat_id for _, cat_id in data_source_category_ids],
+          'whole_data_source_ids': whole_data_source_ids})
+
+
+def get_update_rate_controller(max_rate=DEFAULT_MAX_RATE, max_concurrency=DEFAULT_MAX_CONCURRENCY):
+    """
+    The adaptive rate controller shared by every caller of update_audience_expression.
+    max_rate (requests per second) and max_concurrency cap the load it ever puts on audience-service;
+    they are taken from the first call, which creates the controller.
+    """
+    global _update_rate_controller
+    if _update_rate_controller is None:
+        _update_rate_controller = AdaptiveRateController(max_rate=max_rate, max_concurrency=max_concurrency)
+    return _update_rate_controller
+
+
 def update_audience_expression(audience_expression_audience_id, expression_to_update):
     as_config = get_audience_service_config()
     x_user_id = as_config['x_user_id']
@@ -49,10 +131,10 @@ def update_audience_expression(audience_expression_audience_id, expression_to_up
     print(f"[{env.upper()}] Updating audience {audience_expression_audience_id} at: {url}")
     if url and host:
         headers = {'Host': host, 'X-User-Id': x_user_id}
-        send(method='PUT', url=url,
-             path_param_key="{audience_id}", path_param_value=audience_expression_audience_id,
-             json_data={'expression': expression_to_update['expression'],
-                        'expressionTypeId': 2},
-             request_headers=headers, retry_timer=0)
+        return send(method='PUT', url=url,
+                    path_param_key="{audience_id}", path_param_value=audience_expression_audience_id,
+                    json_data={'expression': expression_to_update['expression'],
+                               'expressionTypeId': 2},
+                    request_headers=headers, retry_timer=0, timeout=UPDATE_TIMEOUT_SECONDS)
     else:
         raise Exception('Could not get audience-service config')
\ No newline at end of file
@@ -1,13 +1,18 @@
 """
 One off to map DS11 to DS35
 """
+import argparse
 import json
-import re
-import time
-import traceback
+import sys
+from collections import Counter
 
-from python.audience_service import update_audience_expression, get_all_audience_expressions
+from python.audience_service import get_all_audience_expressions, get_update_rate_controller, update_audience_expression
 from python.utils.config import config
+from python.utils.expression_fingerprint import APPLIED_CACHE_MAX_AGE_SECONDS, AppliedExpressionCache, \
+    expression_fingerprint, noop_reason
+from python.utils.expression_rewriter import ExpressionRewriter
+from python.utils.migration_journal import APPLIED, FAILED, open_journal
+from python.utils.update_executor import DEFAULT_MAX_CONCURRENCY, DEFAULT_MAX_RATE, print_update_summary, run_updates
 
 ####################################
 #         GLOBAL VARIABLES         #
@@ -16,70 +21,92 @@ from python.utils.config import config
 ORIGIN_DATA_SOURCE_ID = 11  # LiveRamp
 TARGET_DATA_SOURCE_ID = 35  # New Data Source
 
-def update_expression_datasource(expr_json):
-    modified = False
-    # Case 1: interest-style structure (expressionTypeId 2)
-    if 'interest' in expr_json:
-        for section in ['include', 'exclude']:
-            items = expr_json.get('interest', {}).get(section, [])
-            for item in items:
-                for condition in item.get('or', []):
-                    if condition.get('data_source_id') == ORIGIN_DATA_SOURCE_ID:
-                        condition['data_source_id'] = TARGET_DATA_SOURCE_ID
-                        modified = True
+# Every category of the origin data source keeps its id under the target data source
+rewriter = ExpressionRewriter(data_source_mapping={ORIGIN_DATA_SOURCE_ID: TARGET_DATA_SOURCE_ID})
 
-    # Case 2: category-style structure with version 2 — use regex
-    elif expr_json.get('version') == '2':
-        env = config('../config.ini',  'environment')['env']
-        print(f"[{env.upper()}] Processing category-style structure with version 2 for {expr_json}")
-        original_str = json.dumps(expr_json)
-        updated_str = re.sub(r'"data_source_id"\s*:\s*11\b', '"data_source_id": 35', original_str)
-        if updated_str != original_str:
-            expr_json = json.loads(updated_str)
-            modified = True
+def apply_datasource_update(journal, applied_cache, rate_controller=None):
+    """
+    Plan the new expression of every audience of the origin data source, record the plan in the
+    journal and apply it. A resumed run reuses a complete plan and only sends audiences not applied yet.
+    Audiences whose canonical expression would not change, or that the applied cache holds as already
+    updated to it, are skipped.
+    :param rate_controller: AdaptiveRateController pacing the updates, the shared one when None
+    :return: True when every planned audience is applied
+    """
+    if journal.stage_applied('plan'):
+        print("Using the planned expressions of the journal")
+    else:
+        rows = get_all_audience_expressions(ORIGIN_DATA_SOURCE_ID)
+        print(f"Found {len(rows)} audiences to process")
 
-    return expr_json if modified else None
-
-def apply_datasource_update():
-    batch_size = 20
-    sleep_between_batches = 3  # seconds
-
-    rows = get_all_audience_expressions(ORIGIN_DATA_SOURCE_ID)
-    print(f"Found {len(rows)} audiences to process")
-
-    impacted = {}
-
-    for i in range(0, len(rows), batch_size):
-        batch = rows[i:i + batch_size]
-        print(f"\nProcessing batch {i // batch_size + 1} [{i + 1}-{i + len(batch)}]")
-
-        for j, (audience_id, expression_str, advertiser_id, company_name) in enumerate(batch):
-            # print(f"  → Audience Id: {audience_id} Advertiser Id: {advertiser_id} Company Name: {company_name}")
-            # print(f"  → Expression Str: {expression_str}")
+        planned = 0
+        changes = Counter()
+        skipped = Counter()
+        for audience_id, expression_str, advertiser_id, company_name in rows:
             expression_json = json.loads(expression_str)
-            updated_expr_json = update_expression_datasource(expression_json)
-            if updated_expr_json:
-                try:
-                    print(f"  → Updated expression: {updated_expr_json}")
-                    update_audience_expression(audience_id, {
-                        "expression": json.dumps(updated_expr_json, separators=(',', ':')),
-                        "expressionTypeId": 2
-                    })
-                    impacted[advertiser_id] = company_name
-                    time.sleep(0.1)
-                except Exception as e:
-                    print(f"  → Error updating audience {audience_id}: {e}")
-                    traceback.print_exc()
-        print(f"Sleeping {sleep_between_batches}s before next batch...")
-        time.sleep(sleep_between_batches)
+            updated_expr_json, summary = rewriter.rewrite(expression_json)
+            changes += summary
+            reason = noop_reason(audience_id, expression_json, updated_expr_json,
+                                 applied_cache) if summary['expressions_changed'] else None
+            if reason is not None:
+                skipped[reason] += 1
+            elif summary['expressions_changed']:
+                print(f"  → Updated expression: {updated_expr_json}")
+                journal.record_planned(audience_id, advertiser_id, company_name, {
+                    "expression": json.dumps(updated_expr_json, separators=(',', ':')),
+                    "expressionTypeId": 2
+                }, expression_fingerprint(expression_json))
+                planned += 1
+        print(f"Expression changes: {dict(changes)}")
+        journal.record_stage('plan', APPLIED, {'audiences': len(rows), 'planned': planned, 'skipped': dict(skipped)})
+        print(f"{planned} audiences to update, skipped {skipped['unchanged']} unchanged and "
+              f"{skipped['already_applied']} already applied")
 
-    print("\n=== Impacted Advertisers ===")
-    print(json.dumps(impacted, indent=4))
+    previous_fingerprints = journal.previous_fingerprints()
+    updates, already_applied = applied_cache.skip_applied(journal.audiences_to_apply(), previous_fingerprints)
+    for audience_id, _, _, _ in already_applied:
+        journal.record_skipped(audience_id, 'already_applied')
+    print(f"{len(updates)} audience updates to send, skipped {len(already_applied)} already applied")
+    # Requests are paced by the shared adaptive rate controller instead of fixed sleeps between audiences and batches
+    results = run_updates(updates, update_audience_expression, rate_controller or get_update_rate_controller(),
+                          total=len(updates),
+                          on_result=applied_cache.recorder(updates, previous_fingerprints, journal.record_result))
+    print_update_summary(results)
+    failed = sum(result.status == FAILED for result in results)
+    journal.record_stage('update', FAILED if failed else APPLIED, {'sent': len(results), 'failed': failed})
 
-    print(f"Writing impacted advertisers to CSV file...")
+    print("\n=== Impacted Advertisers ===")
+    print(json.dumps(journal.impacted_advertisers(), indent=4))
+    return not failed
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Map data source 11 to data source 35 in audience expressions')
+    parser.add_argument('--resume', action='store_true',
+                        help='Continue the journaled run: skip applied audiences, retry failed and unsent updates')
+    parser.add_argument('--max-rate', type=float, default=DEFAULT_MAX_RATE,
+                        help=f'Most audience-service updates per second, however well it responds '
+                             f'(default: {DEFAULT_MAX_RATE:g})')
+    parser.add_argument('--max-concurrency', type=int, default=DEFAULT_MAX_CONCURRENCY,
+                        help=f'Most audience-service updates in flight at once (default: {DEFAULT_MAX_CONCURRENCY})')
+    parser.add_argument('--applied-cache-max-age', type=float, default=APPLIED_CACHE_MAX_AGE_SECONDS,
+                        help='Seconds an update recorded as applied is trusted over a database that still holds the '
+                             'expression it replaced (replication lag), 0 disables it '
+                             f'(default: {APPLIED_CACHE_MAX_AGE_SECONDS:g})')
+    args = parser.parse_args()
+    if args.max_rate <= 0 or args.max_concurrency < 1:
+        parser.error("--max-rate must be positive and --max-concurrency at least 1")
+
     print("Starting datasource update from 11 to 35...")
-    apply_datasource_update()
-    print("Process complete.")
\ No newline at end of file
+    journal = open_journal(f"ds{ORIGIN_DATA_SOURCE_ID}_to_ds{TARGET_DATA_SOURCE_ID}", args.resume)
+    applied_cache = AppliedExpressionCache(config('../config.ini',  'environment')['env'],
+                                           max_age=args.applied_cache_max_age)
+    try:
+        if not apply_datasource_update(journal, applied_cache,
+                                       get_update_rate_controller(args.max_rate, args.max_concurrency)):
+            print("Some audiences were not updated, run again with --resume to retry them", file=sys.stderr)
+            sys.exit(1)
+    finally:
+        applied_cache.save()
+        journal.close()
+    print("Process complete.")
@@ -0,0 +1,129 @@
+"""
+Micro-benchmark of the expression rewriter on synthetic audience expressions.
+
+Times ExpressionRewriter against the rewrites it replaced: the per-condition rescan of
+map_dscids_to_new_datasource.process_interest and the dump-and-regex data source rewrite of ds11-to-ds35.
+
+    python -m python.expression_rewriter_benchmark --expressions 20000 --groups 8 --conditions 6
+"""
+import argparse
+import copy
+import json
+import random
+import re
+import time
+
+from python.utils.expression_rewriter import ExpressionRewriter
+
+ORIGIN_DATA_SOURCE_ID = 18
+TARGET_DATA_SOURCE_ID = 11
+OTHER_DATA_SOURCE_IDS = [5, 7, 35, 41]
+
+
+def synthetic_expressions(n_expressions, n_groups, n_conditions, n_cats, mapping, rng):
+    """Interest-style expressions whose 'or' groups mix origin, target and other data source conditions"""
+    origin_cats = list(mapping)
+    data_source_ids = [ORIGIN_DATA_SOURCE_ID, TARGET_DATA_SOURCE_ID] + OTHER_DATA_SOURCE_IDS
+    expressions = []
+    for _ in range(n_expressions):
+        def group():
+            conditions = []
+            for data_source_id in rng.sample(data_source_ids, min(n_conditions, len(data_source_ids))):
+                if data_source_id == ORIGIN_DATA_SOURCE_ID:
+                    cats = rng.sample(origin_cats, n_cats // 2) + [rng.randrange(10 ** 6, 2 * 10 ** 6)
+                                                                   for _ in range(n_cats - n_cats // 2)]
+                else:
+                    cats = [rng.randrange(10 ** 6) for _ in range(n_cats)]
+                conditions.append({'data_source_id': data_source_id, 'cats': cats})
+            return {'or': conditions}
+        expressions.append({'interest': {'include': [group() for _ in range(n_groups)],
+                                         'exclude': [group() for _ in range(max(1, n_groups // 4))]}})
+    return expressions
+
+
+def legacy_process_interest(items, mapping):
+    # The previous map_dscids_to_new_datasource rewrite, kept here as the baseline
+    result = False
+    for item in items:
+        conditions = item.get('or', [])
+        for condition in conditions:
+            if condition.get('data_source_id') == ORIGIN_DATA_SOURCE_ID:
+                updated_cats = []
+                target_cats_to_add = []
+                for cat in condition['cats']:
+                    if cat in mapping:
+                        target_cats_to_add.append(mapping[cat])
+                    else:
+                        updated_cats.append(cat)
+                if updated_cats:
+                    condition['cats'] = updated_cats
+                else:
+                    conditions.remove(condition)
+                if target_cats_to_add:
+                    result = True
+                    for existing_item in items:
+                        for existing_condition in existing_item.get('or', []):
+                            if existing_condition.get('data_source_id') == TARGET_DATA_SOURCE_ID:
+                                existing_condition['cats'].extend(target_cats_to_add)
+                                existing_condition['cats'] = list(set(existing_condition['cats']))
+                                existing_condition['cats'].sort()
+                                break
+                        else:
+                            continue
+                        break
+                    else:
+                        conditions.append({'data_source_id': TARGET_DATA_SOURCE_ID, 'cats': target_cats_to_add})
+    return result
+
+
+def legacy_data_source_rewrite(expression):
+    # The previous ds11-to-ds35 version 2 rewrite
+    original_str = json.dumps(expression)
+    updated_str = re.sub(rf'"data_source_id"\s*:\s*{ORIGIN_DATA_SOURCE_ID}\b',
+                         f'"data_source_id": {TARGET_DATA_SOURCE_ID}', original_str)
+    return json.loads(updated_str) if updated_str != original_str else None
+
+
+def timed(label, function, expressions):
+    start = time.perf_counter()
+    for expression in expressions:
+        function(expression)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<40} {elapsed:8.3f}s  {len(expressions) / elapsed:12,.0f} expressions/s")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the audience expression rewriter')
+    parser.add_argument('--expressions', type=int, default=20000, help='Number of synthetic expressions')
+    parser.add_argument('--groups', type=int, default=8, help="'or' groups in the include part of an expression")
+    parser.add_argument('--conditions', type=int, default=6, help="Conditions per 'or' group")
+    parser.add_argument('--cats', type=int, default=20, help='Categories per condition')
+    parser.add_argument('--mapping-size', type=int, default=50000, help='Mapped origin categories')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    mapping = {cat: 5 * 10 ** 6 + cat for cat in rng.sample(range(10 ** 6), args.mapping_size)}
+    expressions = synthetic_expressions(args.expressions, args.groups, args.conditions, args.cats, mapping, rng)
+    print(f"{len(expressions)} expressions, {args.groups} groups of {args.conditions} conditions of "
+          f"{args.cats} categories, {len(mapping)} mapped categories")
+
+    # The legacy rewrites modify their input
+    legacy_copies = copy.deepcopy(expressions)
+    legacy = timed('legacy process_interest', lambda e: (legacy_process_interest(e['interest']['include'], mapping),
+                                                         legacy_process_interest(e['interest']['exclude'], mapping)),
+                   legacy_copies)
+    rewriter = ExpressionRewriter({(ORIGIN_DATA_SOURCE_ID, cat): (TARGET_DATA_SOURCE_ID, target_cat)
+                                   for cat, target_cat in mapping.items()})
+    current = timed('ExpressionRewriter categories', rewriter.rewrite, expressions)
+    print(f"{'speedup':<40} {legacy / current:8.1f}x")
+
+    legacy = timed('legacy data source regex', legacy_data_source_rewrite, expressions)
+    rewriter = ExpressionRewriter(data_source_mapping={ORIGIN_DATA_SOURCE_ID: TARGET_DATA_SOURCE_ID})
+    current = timed('ExpressionRewriter data source', rewriter.rewrite, expressions)
+    print(f"{'speedup':<40} {legacy / current:8.1f}x")
+
+
+if __name__ == '__main__':
+    main()
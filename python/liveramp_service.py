@@ -10,14 +10,18 @@ from python.utils.db_util import execute_query
 MAX_SEGMENTS_PER_REQUEST = 100
 
 def remove_provider_from_liveramp_providers(provider_name):
+    """Returns False when the provider could not be removed"""
     print("Removing origin provider from automated liveramp updates")
     try:
-        execute_query("""
+        if execute_query("""
                 delete from liveramp.non_restricted_providers
                 where provider_name = %s
-            """, (provider_name,))
+            """, (provider_name,)):
+            return True
+        print('Error removing provider in integration', file=sys.stderr)
     except Exception as removal_exception:
         print('Error removing provider in integration: %s' % removal_exception, file=sys.stderr)
+    return False
 
 def get_distribution_managers_by_provider(distribution_manager_name):
     """
@@ -1,8 +1,6 @@
 """
 Description
 
-NOTE: This script does not handle version 2 audience expressions!
-
 This script maps origin data source category ids for a given data source to target data source category ids in active audience campaign groups, then reapplies the audiences.
 All origin data source category ids are marked deprecated in the taxonomy tables.
 
@@ -17,15 +15,21 @@ target_data_source_category_id
 2. CSV_FILE_NAME - CSV file name
 3. ORIGIN_DATA_SOURCE_NAME - Origin data source name
 4. TARGET_DATA_SOURCE_NAME - Target data source name
+Or, to apply several mappings that ship together in one pass, --manifest with a CSV of
+source_id,target_id,mapping_file rows (an empty mapping_file maps every category of the source data source as is,
+like ds11-to-ds35.py). The mappings are composed up front; conflicting mappings (the same category mapped to two
+targets) and chained mappings (a target that is itself mapped) stop the run before any audience is read.
 
 Prerequisites
 The target taxonomy table must be populated with the target data source category ids and tpa.categories (make sure replication to intprod has already happened) must include the target data source
 
 Implementation
-1. Retrieve all audiences expressions for active campaigns and for each expression:
+1. Retrieve, in one scan, the audience expressions that contain an origin category_id listed in the mapping csv(s) (filtered in SQL;
+pass --active-campaign-groups to only retrieve audiences of active campaign groups) and for each expression:
 If the expression contains the origin category_id (origin data_source_id/data_source_category_id pair = origin_cat_key)
 listed in the mapping csv, remove the origin category id and add the target category id
-(target data_source_id/data_source_category_id pair = target_cat_key)
+(target data_source_id/data_source_category_id pair = target_cat_key) to the target data source condition of the
+same 'or' group. Interest-style and version 2 expressions are both rewritten (python/utils/expression_rewriter.py)
 
 2. Reapply the audience expression to the campaign group (using audience-service)
 
@@ -37,20 +41,28 @@ listed in the mapping csv, remove the origin category id and add the target cate
         i. This prevents the automated Liveramp updater (part of oracle-audience-service) from adding new segments for distribution or re-adding segments that were removed from distribution
 
 TODOs
-TODO create version that can be run from command line
 TODO Test removal of segments from Liveramp distribution - implementation complete but not tested
 TODO does data source visibility need to be set in audience.data_sources?
 """
-import csv
+import argparse
 import json
+import os
 import sys
+from collections import Counter
 from datetime import date
 
-from python.audience_service import update_audience_expression, get_all_audience_expressions
+from python.audience_service import (get_audience_expressions_with_categories, get_update_rate_controller,
+                                     update_audience_expression)
 from python.liveramp_service import remove_provider_from_liveramp_providers
 from python.utils.config import config
 from python.utils.data_source_util import get_data_source_table, get_data_source_id
 from python.utils.db_util import execute_query
+from python.utils.expression_fingerprint import APPLIED_CACHE_MAX_AGE_SECONDS, AppliedExpressionCache, \
+    expression_fingerprint, noop_reason
+from python.utils.expression_rewriter import ExpressionRewriter
+from python.utils.migration_journal import APPLIED, FAILED, open_journal
+from python.utils.migration_mappings import MappingConflictError, compose_mappings, read_migration_manifest
+from python.utils.update_executor import DEFAULT_MAX_CONCURRENCY, DEFAULT_MAX_RATE, print_update_summary, run_updates
 
 ####################################
 #         GLOBAL VARIABLES         #
@@ -66,9 +78,12 @@ TARGET_DATA_SOURCE_NAME = 'LiveRamp'
 CSV_FILE_NAME = 'dstillery-to-lr-mapping.csv'
 
 
+
 def deprecate_cats(data_source_id, data_source_category_ids):
-    deprecate_cats_in_coredw(data_source_id, data_source_category_ids)
-    deprecate_cats_by_datasource_in_integration(data_source_id, data_source_category_ids)
+    """Returns False when the categories could not be deprecated in coredw or in integration"""
+    in_coredw = deprecate_cats_in_coredw(data_source_id, data_source_category_ids)
+    in_integration = deprecate_cats_by_datasource_in_integration(data_source_id, data_source_category_ids)
+    return in_coredw and in_integration
 
 
 def deprecate_cats_in_coredw(data_source_id, data_source_category_ids):
@@ -78,7 +93,7 @@ def deprecate_cats_in_coredw(data_source_id, data_source_category_ids):
         env = config('../config.ini',  'environment')['env']
         if env == 'qa':
             schema = 'test'
-        execute_query(f"""
+        return execute_query(f"""
             update {schema}.{table_name}
             set deprecated = true,
             updated_date = current_date
@@ -86,11 +101,12 @@ def deprecate_cats_in_coredw(data_source_id, data_source_category_ids):
         """, (data_source_category_ids,), True)
     except Exception as deprecate_exception:
         print('Error deprecating categories in coredw: %s' % deprecate_exception, file=sys.stderr)
+        return False
 
 
 def deprecate_cats_by_datasource_in_integration(data_source_id, data_source_category_ids):
     try:
-        execute_query("""
+        return execute_query("""
                 update tpa.categories
                 set deprecated = true
                 where data_source_id = %s
@@ -98,92 +114,164 @@ def deprecate_cats_by_datasource_in_integration(data_source_id, data_source_cate
             """, (data_source_id, data_source_category_ids,))
     except Exception as deprecate_exception:
         print('Error deprecating categories in integration: %s' % deprecate_exception, file=sys.stderr)
-
-
-def get_origin_target_mapping_from_file(origin_target_mapping_file_name=CSV_FILE_NAME):
-    reader = csv.DictReader(open('../mapping_files/' + origin_target_mapping_file_name, "r", encoding='utf-8'))
-    origin_target_mapping_dict = {}
-    for line in reader:
-        origin_target_mapping_dict[int(line['origin_data_source_category_id'])] = int(
-            line['target_data_source_category_id'])
-    return origin_target_mapping_dict
-
-
-def apply_mapping(mapping):
-    def process_interest(items):
-        result = False
-        for item in items:
-            conditions = item.get('or', [])
-            for condition in conditions:
-                if condition.get('data_source_id') == get_data_source_id(ORIGIN_DATA_SOURCE_NAME):
-                    updated_cats = []
-                    target_cats_to_add = []
-                    for cat in condition['cats']:
-                        if cat in mapping:
-                            target_cats_to_add.append(mapping[cat])
-                        else:
-                            updated_cats.append(cat)
-                    if updated_cats:
-                        condition['cats'] = updated_cats
-                    else:
-                        conditions.remove(condition)
-                    if target_cats_to_add:
-                        result = True
-                        for existing_item in items:
-                            for existing_condition in existing_item.get('or', []):
-                                if existing_condition.get('data_source_id') == get_data_source_id(TARGET_DATA_SOURCE_NAME):
-                                    existing_condition['cats'].extend(target_cats_to_add)
-                                    existing_condition['cats'] = list(set(existing_condition['cats']))
-                                    existing_condition['cats'].sort()
-                                    break
-                            else:
-                                continue
-                            break
-                        else:
-                            conditions.append({'data_source_id': get_data_source_id(TARGET_DATA_SOURCE_NAME), 'cats': target_cats_to_add})
-        return result
-
-    impact = {}
-    rows = get_all_audience_expressions(get_data_source_id(ORIGIN_DATA_SOURCE_NAME))
-    for i, audience_expression_row in enumerate(rows):
-        audience_expression_audience_id = audience_expression_row[0]
-        audience_expression_advertiser_id = audience_expression_row[2]
-        audience_expression_company_name = audience_expression_row[3]
-        audience_expression_expression = json.loads(audience_expression_row[1])
-        if 'interest' in audience_expression_expression:
-            interest = audience_expression_expression['interest']
-            include = interest['include']
-            exclude = interest['exclude']
-            if process_interest(include) or process_interest(exclude):
-                impact[audience_expression_advertiser_id] = audience_expression_company_name
+        return False
+
+
+def apply_mappings(category_mapping, data_source_mapping, journal, applied_cache, active_campaign_groups_only=False,
+                   rate_controller=None):
+    """
+    Plan the new expression of every affected audience, record the plan in the journal and apply it.
+    All the mappings are applied in one scan of the audiences, with at most one update per audience.
+    When resuming a run whose plan is complete, the journal's plan is used and the audiences are not
+    fetched again; only audiences not applied yet are sent.
+    Audiences whose canonical expression would not change, or that the applied cache holds as already
+    updated to it, are skipped.
+    :param rate_controller: AdaptiveRateController pacing the updates, the shared one when None
+    :return: True when every planned audience is applied
+    """
+    rewriter = ExpressionRewriter(category_mapping, data_source_mapping)
+
+    if journal.stage_applied('plan'):
+        print("Using the planned expressions of the journal")
+    else:
+        # Only audiences referencing a mapped origin category are fetched
+        rows = get_audience_expressions_with_categories(category_mapping.keys(), data_source_mapping.keys(),
+                                                        active_campaign_groups_only)
+        planned = 0
+        changes = Counter()
+        skipped = Counter()
+        for audience_expression_row in rows:
+            audience_expression_audience_id = audience_expression_row[0]
+            audience_expression_advertiser_id = audience_expression_row[2]
+            audience_expression_company_name = audience_expression_row[3]
+            stored_expression = json.loads(audience_expression_row[1])
+            audience_expression_expression, summary = rewriter.rewrite(stored_expression)
+            changes += summary
+            reason = noop_reason(audience_expression_audience_id, stored_expression, audience_expression_expression,
+                                 applied_cache) if summary['expressions_changed'] else None
+            if reason is not None:
+                skipped[reason] += 1
+            elif summary['expressions_changed']:
                 audience_update = {
                     "expression": json.dumps(audience_expression_expression, separators=(',', ':')),
                     "expressionTypeId": 2
                 }
-                update_audience_expression(audience_expression_audience_id, audience_update)
-        print(f'done - [{i + 1}/{len(rows)}]')
-    print(json.dumps(impact, indent=4))
-
+                journal.record_planned(audience_expression_audience_id, audience_expression_advertiser_id,
+                                       audience_expression_company_name, audience_update,
+                                       expression_fingerprint(stored_expression))
+                planned += 1
+            elif summary['conditions_unsupported']:
+                print(f"  → Audience {audience_expression_audience_id} has origin categories that cannot be "
+                      f"mapped in place, left unchanged", file=sys.stderr)
+        print(f"Expression changes: {dict(changes)}")
+        journal.record_stage('plan', APPLIED, {'audiences': len(rows), 'planned': planned, 'skipped': dict(skipped)})
+        print(f"{planned} of {len(rows)} audiences to update, skipped {skipped['unchanged']} unchanged and "
+              f"{skipped['already_applied']} already applied")
+
+    previous_fingerprints = journal.previous_fingerprints()
+    updates, already_applied = applied_cache.skip_applied(journal.audiences_to_apply(), previous_fingerprints)
+    for audience_id, _, _, _ in already_applied:
+        journal.record_skipped(audience_id, 'already_applied')
+    print(f"{len(updates)} audience updates to send, skipped {len(already_applied)} already applied")
+    results = run_updates(updates, update_audience_expression, rate_controller or get_update_rate_controller(),
+                          total=len(updates),
+                          on_result=applied_cache.recorder(updates, previous_fingerprints, journal.record_result))
+    print_update_summary(results)
+    failed = sum(result.status == FAILED for result in results)
+    journal.record_stage('update', FAILED if failed else APPLIED, {'sent': len(results), 'failed': failed})
+    print(json.dumps(journal.impacted_advertisers(), indent=4))
+    return not failed
 
 if __name__ == '__main__':
-    print("ENV: %s" % config('../config.ini',  'environment')['env'])
-    print("Mapping data source categories for dsid %s to dsid %s in active audience expressions using %s" % (
-        get_data_source_id(ORIGIN_DATA_SOURCE_NAME), get_data_source_id(TARGET_DATA_SOURCE_NAME), CSV_FILE_NAME))
+    parser = argparse.ArgumentParser(description='Map origin data source categories to target categories in audiences')
+    parser.add_argument('--active-campaign-groups', action='store_true',
+                        help='Only update audiences of active campaign groups (default: all audiences)')
+    parser.add_argument('--manifest', type=str, default=None,
+                        help='CSV with source_id,target_id,mapping_file columns (the enrich-mapping manifest): apply '
+                             'every listed mapping in one pass, an empty mapping_file maps the whole data source '
+                             '(default: the GLOBAL VARIABLES mapping)')
+    parser.add_argument('--resume', action='store_true',
+                        help='Continue the journaled run: skip applied audiences and completed stages, '
+                             'retry failed and unsent updates')
+    parser.add_argument('--max-rate', type=float, default=DEFAULT_MAX_RATE,
+                        help=f'Most audience-service updates per second, however well it responds '
+                             f'(default: {DEFAULT_MAX_RATE:g})')
+    parser.add_argument('--max-concurrency', type=int, default=DEFAULT_MAX_CONCURRENCY,
+                        help=f'Most audience-service updates in flight at once (default: {DEFAULT_MAX_CONCURRENCY})')
+    parser.add_argument('--applied-cache-max-age', type=float, default=APPLIED_CACHE_MAX_AGE_SECONDS,
+                        help='Seconds an update recorded as applied is trusted over a database that still holds the '
+                             'expression it replaced (replication lag), 0 disables it '
+                             f'(default: {APPLIED_CACHE_MAX_AGE_SECONDS:g})')
+    args = parser.parse_args()
+    if args.max_rate <= 0 or args.max_concurrency < 1:
+        parser.error("--max-rate must be positive and --max-concurrency at least 1")
 
-    origin_target_mapping = get_origin_target_mapping_from_file()
-
-    apply_mapping(origin_target_mapping)
-
-    print("Deprecating categories")
-    cats_to_deprecate = list(origin_target_mapping.keys())
-    deprecate_cats(get_data_source_id(ORIGIN_DATA_SOURCE_NAME), cats_to_deprecate)
-    print("Deprecated %s categories" % len(cats_to_deprecate))
-
-    if get_data_source_id(ORIGIN_DATA_SOURCE_NAME) == get_data_source_id('LiveRamp'):
-        if REMOVE_SEGMENTS_FROM_LR_DISTRIBUTION:
-            print("")
-            # TODO: Needs testing: remove_segments_from_distribution(cats_to_deprecate)
-        if REMOVE_ORIGIN_PROVIDER_FROM_AUTOMATED_LR_UPDATES:
-            remove_provider_from_liveramp_providers(ORIGIN_PROVER_NAME)
+    print("ENV: %s" % config('../config.ini',  'environment')['env'])
+    print("Mapping data source categories in audience expressions:")
+
+    if args.manifest is not None:
+        entries = read_migration_manifest(args.manifest)
+        journal_name = f"map_{os.path.splitext(os.path.basename(args.manifest))[0]}"
+    else:
+        entries = [(get_data_source_id(ORIGIN_DATA_SOURCE_NAME), get_data_source_id(TARGET_DATA_SOURCE_NAME),
+                    CSV_FILE_NAME)]
+        journal_name = f"map_{os.path.splitext(CSV_FILE_NAME)[0]}_{ORIGIN_DATA_SOURCE_NAME}_to_{TARGET_DATA_SOURCE_NAME}"
+    for origin_data_source_id, target_data_source_id, mapping_file in entries:
+        print(f"  {origin_data_source_id} -> {target_data_source_id}: {mapping_file or 'every category'}")
+    try:
+        category_mapping, data_source_mapping = compose_mappings(entries)
+    except MappingConflictError as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+    print(f"{len(category_mapping)} mapped categories, {len(data_source_mapping)} mapped data sources")
+
+    journal = open_journal(journal_name, args.resume)
+    applied_cache = AppliedExpressionCache(config('../config.ini',  'environment')['env'],
+                                           max_age=args.applied_cache_max_age)
+    try:
+        if not apply_mappings(category_mapping, data_source_mapping, journal, applied_cache,
+                              args.active_campaign_groups,
+                              get_update_rate_controller(args.max_rate, args.max_concurrency)):
+            # Categories are only deprecated once no audience references them any more
+            print("Some audiences were not updated, run again with --resume to retry them", file=sys.stderr)
+            sys.exit(1)
+
+        # Data sources mapped as a whole keep their categories, only mapped categories are deprecated
+        cats_to_deprecate = {}
+        for origin_data_source_id, origin_cat in category_mapping:
+            cats_to_deprecate.setdefault(origin_data_source_id, []).append(origin_cat)
+        if journal.stage_applied('deprecate'):
+            print("Categories already deprecated")
+        else:
+            print("Deprecating categories")
+            failed_data_source_ids = []
+            for origin_data_source_id, origin_cats in cats_to_deprecate.items():
+                if deprecate_cats(origin_data_source_id, origin_cats):
+                    print("Deprecated %s categories of dsid %s" % (len(origin_cats), origin_data_source_id))
+                else:
+                    failed_data_source_ids.append(origin_data_source_id)
+            detail = {str(origin_data_source_id): len(origin_cats)
+                      for origin_data_source_id, origin_cats in cats_to_deprecate.items()}
+            if failed_data_source_ids:
+                detail['failed'] = failed_data_source_ids
+            journal.record_stage('deprecate', FAILED if failed_data_source_ids else APPLIED, detail)
+            if failed_data_source_ids:
+                print("Categories of dsid %s were not deprecated, run again with --resume to retry them"
+                      % failed_data_source_ids, file=sys.stderr)
+                sys.exit(1)
+
+        if get_data_source_id('LiveRamp') in cats_to_deprecate:
+            if REMOVE_SEGMENTS_FROM_LR_DISTRIBUTION:
+                print("")
+                # TODO: Needs testing: remove_segments_from_distribution(cats_to_deprecate[get_data_source_id('LiveRamp')])
+            if REMOVE_ORIGIN_PROVIDER_FROM_AUTOMATED_LR_UPDATES and not journal.stage_applied('liveramp'):
+                removed = remove_provider_from_liveramp_providers(ORIGIN_PROVER_NAME)
+                journal.record_stage('liveramp', APPLIED if removed else FAILED, {'provider': ORIGIN_PROVER_NAME})
+                if not removed:
+                    print("Run again with --resume to retry removing the provider", file=sys.stderr)
+                    sys.exit(1)
+    finally:
+        applied_cache.save()
+        journal.close()
 
     print("Process complete")
\ No newline at end of file
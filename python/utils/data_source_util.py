@@ -1,4 +1,6 @@
-from python.utils.db_util import execute_fetch_all_with_vars_query
+import time
+
+from python.utils.db_util import execute_fetch_all_query
 
 """
 data_source_id,name
@@ -21,33 +23,63 @@ data_source_id,name
 37,CallRail
 """
 
+# Deleted from audience.data_sources already, but still referenced by mappings and audiences
+DELETED_DATA_SOURCES = {
+    'Dstillery': 18,
+    'OnAudience': 20,
+}
+
+# Taxonomy table of the data sources that have one, by data source name
+DATA_SOURCE_TABLES = {
+    'Oracle': 'oracle_categories',
+    'LiveRamp': 'liveramp_categories',
+    'Experian': 'experian_categories',
+    'ShareThis': 'sharethis_categories',
+    'Dstillery': 'dstillery_categories',
+    'OnAudience': 'onaudience_categories',
+}
+
+# Seconds before the registry is read from the database again; None keeps it for the whole run
+DATA_SOURCE_REGISTRY_TTL = None
+
+# Data source ids by name, loaded once from audience.data_sources
+_registry = {'ids_by_name': None, 'loaded_at': None}
+
+def load_data_source_registry():
+    """Data source ids by name: every row of audience.data_sources plus the deleted data sources"""
+    rows = execute_fetch_all_query("""
+        select data_source_id, name from audience.data_sources
+    """)
+    if rows is None:
+        return None
+    ids_by_name = {name: data_source_id for data_source_id, name in rows}
+    ids_by_name.update(DELETED_DATA_SOURCES)
+    return ids_by_name
+
+def get_data_source_registry(ttl=DATA_SOURCE_REGISTRY_TTL):
+    """
+    Data source ids by name, read from the database on first use and again once older than ttl
+    seconds. A failed read is not kept, so the next lookup tries again.
+    """
+    loaded_at = _registry['loaded_at']
+    if loaded_at is None or (ttl is not None and time.time() - loaded_at > ttl):
+        ids_by_name = load_data_source_registry()
+        if ids_by_name is None:
+            print("Error fetching data sources from audience.data_sources")
+            return dict(_registry['ids_by_name'] or DELETED_DATA_SOURCES)
+        _registry['ids_by_name'] = ids_by_name
+        _registry['loaded_at'] = time.time()
+    return _registry['ids_by_name']
+
 def get_data_source_table(data_source_id):
-    table_name = ""
-    if data_source_id == get_data_source_id('Oracle'):
-        table_name = 'oracle_categories'
-    elif data_source_id == get_data_source_id('LiveRamp'):
-        table_name = 'liveramp_categories'
-    elif data_source_id == get_data_source_id('Experian'):
-        table_name = 'experian_categories'
-    elif data_source_id == get_data_source_id('ShareThis'):
-        table_name = 'sharethis_categories'
-    elif data_source_id == get_data_source_id('Dstillery'):
-        table_name = 'dstillery_categories'
-    elif data_source_id == get_data_source_id('OnAudience'):
-        table_name = 'onaudience_categories'
-    else:
-        raise Exception(f"source table not found for data_source_id {data_source_id}")
-    return table_name
+    ids_by_name = get_data_source_registry()
+    for data_source_name, table_name in DATA_SOURCE_TABLES.items():
+        if data_source_id is not None and data_source_id == ids_by_name.get(data_source_name):
+            return table_name
+    raise Exception(f"source table not found for data_source_id {data_source_id}")
 
 def get_data_source_id(data_source_name):
-    if data_source_name == 'Dstillery':
-        return 18 # Dstillery was deleted from data sources already.
-    if data_source_name == 'OnAudience':
-        return 20 # OnAudience was deleted from data sources already.
-    try:
-        return execute_fetch_all_with_vars_query("""
-            select data_source_id from audience.data_sources where name = %s
-        """, (data_source_name,))[0][0]
-    except Exception as e:
-        print(f"Error fetching data source ID for {data_source_name}: {e}")
-        return None
\ No newline at end of file
+    data_source_id = get_data_source_registry().get(data_source_name)
+    if data_source_id is None:
+        print(f"Error fetching data source ID for {data_source_name}: no such data source")
+    return data_source_id
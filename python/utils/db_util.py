@@ -1,4 +1,5 @@
 import inspect
+import os
 import sys
 
 import psycopg2
@@ -7,10 +8,15 @@ from psycopg2.extras import execute_batch
 from python.utils.config import load_config_with_pass, config
 
 
-integration_qa_db_config = load_config_with_pass('../config.ini', '../pass.ini', 'qacoredb')
-integration_prod_db_config = load_config_with_pass('../config.ini', '../pass.ini', 'integrationprod')
-coredw_prod_db_config = load_config_with_pass('../config.ini', '../pass.ini', 'redshift_coredw')
-env = config('../config.ini',  'environment')['env']
+# Resolved from the repository root so the match_finder commands (run from the root) can use this module too
+ROOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..')
+CONFIG_FILE = os.path.join(ROOT_DIR, 'config.ini')
+PASS_FILE = os.path.join(ROOT_DIR, 'pass.ini')
+
+integration_qa_db_config = load_config_with_pass(CONFIG_FILE, PASS_FILE, 'qacoredb')
+integration_prod_db_config = load_config_with_pass(CONFIG_FILE, PASS_FILE, 'integrationprod')
+coredw_prod_db_config = load_config_with_pass(CONFIG_FILE, PASS_FILE, 'redshift_coredw')
+env = config(CONFIG_FILE,  'environment')['env']
 
 def get_db_config(is_dw):
     if is_dw:
@@ -24,6 +30,7 @@ def get_db_config(is_dw):
             raise ValueError(f"Unknown environment: {env}")
 
 def execute_query(sql, query_vars, is_dw=False):
+    """Run a statement and commit it; returns False when it failed (the error is printed)"""
     db_config=get_db_config(is_dw)
     conn = None
     try:
@@ -32,8 +39,10 @@ def execute_query(sql, query_vars, is_dw=False):
         cur.execute(sql, query_vars)
         conn.commit()
         cur.close()
+        return True
     except (Exception, psycopg2.DatabaseError) as error:
         _handle_db_exception(error)
+        return False
     finally:
         if conn is not None:
             conn.close()
@@ -79,6 +88,34 @@ def execute_fetch_all_with_vars_query(sql, query_vars, is_dw=False):
             conn.close()
 
 
+def execute_fetch_batches_with_vars_query(sql, query_vars, batch_size=10000, is_dw=False):
+    """
+    Yields the rows of a query in lists of up to batch_size rows. A server-side (named) cursor is
+    used, so the full result is never held in memory on the client.
+    Unlike the other fetch functions, errors are re-raised: a silently truncated stream would look
+    like a complete result.
+    """
+    db_config=get_db_config(is_dw)
+    conn = None
+    try:
+        conn = psycopg2.connect(**db_config)
+        cur = conn.cursor(name='fetch_batches')
+        cur.itersize = batch_size
+        cur.execute(sql, query_vars)
+        while True:
+            rows = cur.fetchmany(batch_size)
+            if not rows:
+                break
+            yield rows
+        cur.close()
+    except (Exception, psycopg2.DatabaseError) as error:
+        _handle_db_exception(error)
+        raise
+    finally:
+        if conn is not None:
+            conn.close()
+
+
 def mogrify_query(sql, query_vars, is_dw=False):
     db_config=get_db_config(is_dw)
     conn = None
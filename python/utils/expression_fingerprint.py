@@ -0,0 +1,127 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+APPLIED_CACHE_DIR = '../migration_journals'
+
+# Applied fingerprints are trusted this long, enough to cover the replication lag of the
+# database the audiences are read from; 0 disables the cache
+APPLIED_CACHE_MAX_AGE_SECONDS = 10 * 60
+
+
+def _cat_sort_key(cat):
+    return str(cat), type(cat).__name__
+
+
+def canonical_expression(expression):
+    """
+    Expression with every cats list sorted and deduplicated, so equivalent expressions compare equal.
+    Category ids may mix ints and strings, they are sorted by their string form, then type.
+    """
+    if isinstance(expression, dict):
+        return {key: sorted(set(value), key=_cat_sort_key) if key == 'cats' and isinstance(value, list)
+                else canonical_expression(value)
+                for key, value in expression.items()}
+    if isinstance(expression, list):
+        return [canonical_expression(value) for value in expression]
+    return expression
+
+
+def expression_fingerprint(expression):
+    """sha256 of the canonical JSON form of an expression, given as a JSON string or parsed"""
+    if isinstance(expression, str):
+        expression = json.loads(expression)
+    canonical = json.dumps(canonical_expression(expression), sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def noop_reason(audience_id, stored_expression, new_expression, applied_cache=None):
+    """
+    Why updating an audience from its stored expression to new_expression would change nothing:
+    'unchanged' when both have the same canonical form, 'already_applied' when the cache holds this
+    very update, from the stored expression to new_expression, as recently applied (the stored
+    expression being a replica that has not caught up yet), None when the update is needed.
+    """
+    fingerprint = expression_fingerprint(new_expression)
+    stored_fingerprint = expression_fingerprint(stored_expression)
+    if fingerprint == stored_fingerprint:
+        return 'unchanged'
+    if applied_cache is not None and applied_cache.is_applied(audience_id, fingerprint, stored_fingerprint):
+        return 'already_applied'
+    return None
+
+
+class AppliedExpressionCache:
+    """
+    Local record of the expression fingerprint last applied to every audience of an environment, with
+    the fingerprint of the expression it replaced. Catches updates that were sent but are not visible
+    yet in the database the audiences are read from: an audience is only skipped while the database
+    still holds the expression the update replaced, so any other change made since is never overridden.
+    """
+
+    def __init__(self, env, cache_dir=APPLIED_CACHE_DIR, max_age=APPLIED_CACHE_MAX_AGE_SECONDS):
+        self.path = os.path.join(cache_dir, f"applied_expressions_{env}.json")
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.entries = {}
+        if os.path.exists(self.path):
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.entries = json.load(f)
+
+    def is_applied(self, audience_id, fingerprint, previous_fingerprint):
+        """Whether the update of an audience from previous_fingerprint to fingerprint was applied recently"""
+        entry = self.entries.get(str(audience_id))
+        return (previous_fingerprint is not None and entry is not None and entry['fingerprint'] == fingerprint
+                and entry.get('previous_fingerprint') == previous_fingerprint
+                and time.time() - entry['applied_at'] < self.max_age)
+
+    def record(self, audience_id, fingerprint, previous_fingerprint):
+        with self.lock:
+            self.entries[str(audience_id)] = {'fingerprint': fingerprint, 'previous_fingerprint': previous_fingerprint,
+                                              'applied_at': time.time()}
+
+    def skip_applied(self, updates, previous_fingerprints):
+        """
+        Split (audience_id, advertiser_id, company_name, payload) updates into (updates to send, updates
+        recorded as applied from the same previous expression)
+        :param previous_fingerprints: {audience_id: fingerprint of the expression the update replaces}
+        """
+        to_send = []
+        applied = []
+        for update in updates:
+            if self.is_applied(update[0], expression_fingerprint(update[3]['expression']),
+                               previous_fingerprints.get(update[0])):
+                applied.append(update)
+            else:
+                to_send.append(update)
+        return to_send, applied
+
+    def recorder(self, updates, previous_fingerprints, on_result=None):
+        """on_result callback for run_updates that records the fingerprints of every applied update"""
+        fingerprints = {update[0]: expression_fingerprint(update[3]['expression']) for update in updates}
+
+        def record_result(result):
+            if on_result is not None:
+                on_result(result)
+            previous_fingerprint = previous_fingerprints.get(result.audience_id)
+            if result.status == 'applied' and previous_fingerprint is not None:
+                self.record(result.audience_id, fingerprints[result.audience_id], previous_fingerprint)
+        return record_result
+
+    def save(self):
+        if self.max_age <= 0:
+            # Disabled: the entries of other runs are left as they are
+            return
+        with self.lock:
+            # Expired entries are never used again
+            now = time.time()
+            entries = {audience_id: entry for audience_id, entry in self.entries.items()
+                       if now - entry['applied_at'] < self.max_age}
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.path) or '.', suffix='.tmp')
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(entries, f)
+            os.replace(tmp_path, self.path)
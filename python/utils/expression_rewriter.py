@@ -0,0 +1,243 @@
+from collections import Counter
+
+OR_KEY = 'or'
+
+
+def _sorted_cats(cats):
+    try:
+        return sorted(cats)
+    except TypeError:
+        # Category ids mixing ints and strings
+        return sorted(cats, key=str)
+
+
+class ExpressionRewriter:
+    """
+    Rewrites the data source categories of audience expressions in a single walk of the expression tree.
+
+    Category mapping: {(origin data_source_id, cat): (target data_source_id, target cat)}.
+    Data source mapping: {origin data_source_id: target data_source_id}, every category of the origin
+    data source is kept as is under the target data source (e.g. DS11 to DS35).
+
+    Conditions are dicts with a data_source_id and a cats list. The conditions of an 'or' list are one
+    group: mapped categories leave their condition (the condition is dropped once it has none left) and
+    are added to the group's condition of the target data source, which is created where the first
+    emptied origin condition was when the group has none. Interest-style expressions
+    ({"interest": {"include": [{"or": [...]}], "exclude": [...]}}) and version-2 category expressions are
+    walked the same way. A condition outside an 'or' list can only be rewritten in place, when all its
+    categories move to one target data source; other ones are left unchanged and counted as
+    conditions_unsupported.
+
+    Only the parts of an expression that change are copied: untouched subtrees, 'or' groups and
+    conditions of the rewritten expression are the input's own objects, and groups without a
+    condition of an origin data source are not indexed at all.
+    """
+
+    def __init__(self, category_mapping=None, data_source_mapping=None):
+        self.data_source_mapping = dict(data_source_mapping or {})
+        # origin data source -> {origin cat: (target data source, target cat)}
+        self.category_mapping = {}
+        for (data_source_id, cat), target in (category_mapping or {}).items():
+            self.category_mapping.setdefault(data_source_id, {})[cat] = target
+        # origin data source whose categories all move to one target data source -> (that data source,
+        # {origin cat: target cat}), so its conditions are split without a per-category dict lookup
+        self.single_target_mapping = {}
+        for data_source_id, cat_mapping in self.category_mapping.items():
+            target_data_source_ids = {target_data_source_id for target_data_source_id, _ in cat_mapping.values()}
+            if len(target_data_source_ids) == 1:
+                self.single_target_mapping[data_source_id] = (
+                    target_data_source_ids.pop(), {cat: target_cat for cat, (_, target_cat) in cat_mapping.items()})
+        self.origin_data_source_ids = set(self.data_source_mapping) | set(self.category_mapping)
+        self.target_data_source_ids = set(self.data_source_mapping.values()) | {
+            target_data_source_id for target_data_source_id, _ in (category_mapping or {}).values()}
+
+    def rewrite(self, expression):
+        """
+        :param expression: parsed expression, it is not modified; the rewritten expression shares its
+                           unchanged parts
+        :return: (rewritten expression, change summary); the summary is a Counter of categories_mapped,
+                 conditions_removed, conditions_added, conditions_merged, conditions_rewritten and
+                 conditions_unsupported, with expressions_changed 1 when the expression changed. The
+                 summaries of many expressions can be added up.
+        """
+        summary = Counter()
+        rewritten = self._walk(expression, summary)
+        # Only a change copies the expression
+        if rewritten is not expression:
+            summary['expressions_changed'] = 1
+        return rewritten, summary
+
+    def _walk(self, node, summary):
+        """node itself when nothing in it changes, otherwise a copy of the changed path"""
+        if isinstance(node, dict):
+            if self._is_condition(node):
+                return self._rewrite_single(node, summary)
+            rewritten = None
+            for key, value in node.items():
+                if key == OR_KEY and isinstance(value, list):
+                    new_value = self._rewrite_group(value, summary)
+                elif isinstance(value, (dict, list)):
+                    new_value = self._walk(value, summary)
+                else:
+                    continue
+                if new_value is not value:
+                    if rewritten is None:
+                        rewritten = dict(node)
+                    rewritten[key] = new_value
+            return node if rewritten is None else rewritten
+        if isinstance(node, list):
+            return self._walk_list(node, summary)
+        return node
+
+    def _walk_list(self, nodes, summary):
+        rewritten = None
+        for position, value in enumerate(nodes):
+            if not isinstance(value, (dict, list)):
+                continue
+            new_value = self._walk(value, summary)
+            if new_value is not value:
+                if rewritten is None:
+                    rewritten = list(nodes)
+                rewritten[position] = new_value
+        return nodes if rewritten is None else rewritten
+
+    @staticmethod
+    def _is_condition(node):
+        return 'data_source_id' in node and isinstance(node.get('cats', []), list)
+
+    def _split(self, condition):
+        """(cats staying in the condition, {target data source: target cats}) of an origin condition"""
+        data_source_id = condition['data_source_id']
+        cats = condition.get('cats', [])
+        if data_source_id in self.data_source_mapping:
+            return [], {self.data_source_mapping[data_source_id]: list(cats)}
+        single_target = self.single_target_mapping.get(data_source_id)
+        if single_target is not None:
+            target_data_source_id, target_cats = single_target
+            moved = [target_cat for target_cat in map(target_cats.get, cats) if target_cat is not None]
+            if not moved:
+                return cats, {}
+            return [cat for cat in cats if cat not in target_cats], {target_data_source_id: moved}
+        cat_mapping = self.category_mapping[data_source_id]
+        mapped = cat_mapping.keys() & cats
+        if not mapped:
+            return cats, {}
+        moved = {}
+        staying = []
+        for cat in cats:
+            if cat in mapped:
+                target_data_source_id, target_cat = cat_mapping[cat]
+                moved.setdefault(target_data_source_id, []).append(target_cat)
+            else:
+                staying.append(cat)
+        return staying, moved
+
+    def _rewrite_single(self, condition, summary):
+        if condition['data_source_id'] not in self.origin_data_source_ids:
+            return condition
+        staying, moved = self._split(condition)
+        if not moved:
+            return condition
+        if staying or len(moved) > 1:
+            summary['conditions_unsupported'] += 1
+            return condition
+        (target_data_source_id, target_cats), = moved.items()
+        summary['categories_mapped'] += len(target_cats)
+        summary['conditions_rewritten'] += 1
+        rewritten = {**condition, 'data_source_id': target_data_source_id}
+        if 'cats' in condition:
+            rewritten['cats'] = list(dict.fromkeys(target_cats))
+        return rewritten
+
+    def _rewrite_group(self, conditions, summary):
+        origin_data_source_ids = self.origin_data_source_ids
+        target_data_source_ids = self.target_data_source_ids
+        origin_positions = []
+        # target data source -> position of the group's first condition of it
+        index = {}
+        # Copy of the group, only made once something in it changes
+        slots = None
+        for position, condition in enumerate(conditions):
+            # self._is_condition, inlined as it runs for every condition of every group
+            if isinstance(condition, dict) and 'data_source_id' in condition \
+                    and isinstance(condition.get('cats', []), list):
+                data_source_id = condition['data_source_id']
+                if data_source_id in origin_data_source_ids:
+                    origin_positions.append(position)
+                elif data_source_id in target_data_source_ids and data_source_id not in index:
+                    index[data_source_id] = position
+            elif isinstance(condition, (dict, list)):
+                rewritten = self._walk(condition, summary)
+                if rewritten is not condition:
+                    if slots is None:
+                        slots = list(conditions)
+                    slots[position] = rewritten
+        if not origin_positions:
+            # Nothing of the group itself moves, only nested expressions may have changed
+            return conditions if slots is None else slots
+        nested_changed = slots is not None
+        if slots is None:
+            slots = list(conditions)
+
+        # target data source -> cats to add
+        additions = {}
+        # target data source -> position of the first origin condition emptied towards it
+        placeholders = {}
+        # positions of the emptied origin conditions
+        emptied = set()
+        for position in origin_positions:
+            condition = conditions[position]
+            staying, moved = self._split(condition)
+            if moved and not staying:
+                placeholders.setdefault(next(iter(moved)), position)
+                emptied.add(position)
+            else:
+                if moved:
+                    slots[position] = {**condition, 'cats': staying}
+                if condition['data_source_id'] in target_data_source_ids:
+                    # A data source both mapped and mapped to: its first remaining condition
+                    index.setdefault(condition['data_source_id'], position)
+            for target_data_source_id, target_cats in moved.items():
+                if target_data_source_id in additions:
+                    additions[target_data_source_id].update(target_cats)
+                else:
+                    additions[target_data_source_id] = set(target_cats)
+        if not additions:
+            # Origin conditions without a mapped category
+            return slots if nested_changed else conditions
+
+        removed = len(emptied)
+        categories_mapped = merged = added = 0
+        for target_data_source_id, cats in additions.items():
+            categories_mapped += len(cats)
+            position = index.get(target_data_source_id)
+            if position is not None:
+                existing = slots[position]
+                # The set is this group's own, it can take the existing cats in place
+                cats.update(existing.get('cats', ()))
+                if cats or 'cats' in existing:
+                    slots[position] = {**existing, 'cats': _sorted_cats(cats)}
+                merged += 1
+                continue
+            new_condition = {'data_source_id': target_data_source_id}
+            position = placeholders.get(target_data_source_id)
+            # A whole data source mapping of conditions without cats adds none
+            if cats or position is None or 'cats' in conditions[position]:
+                new_condition['cats'] = _sorted_cats(cats)
+            if position is None:
+                slots.append(new_condition)
+            else:
+                # Takes the place, and the other keys, of the origin condition it replaces
+                slots[position] = {**conditions[position], **new_condition}
+                emptied.discard(position)
+            added += 1
+        summary['categories_mapped'] += categories_mapped
+        if merged:
+            summary['conditions_merged'] += merged
+        if added:
+            summary['conditions_added'] += added
+        if removed:
+            summary['conditions_removed'] += removed
+        if emptied:
+            return [slot for position, slot in enumerate(slots) if position not in emptied]
+        return slots
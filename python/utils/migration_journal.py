@@ -0,0 +1,129 @@
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+JOURNAL_DIR = '../migration_journals'
+
+# Records are written as they come and fsync'd at least this often
+FSYNC_EVERY_RECORDS = 100
+FSYNC_EVERY_SECONDS = 1.0
+
+PENDING = 'pending'
+APPLIED = 'applied'
+FAILED = 'failed'
+
+
+class MigrationJournal:
+    """
+    Append-only JSON lines journal of a migration run: the planned expression and status of every
+    audience, and the status of every stage (plan, update, deprecate, liveramp, ...). The last
+    record of an audience or stage is its current state, so a run can be resumed from the file.
+    Safe to use from the update executor's worker threads.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.audiences = {}
+        self.stages = {}
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        self._apply(json.loads(line))
+                    except json.JSONDecodeError:
+                        # Only the last line can be partial, if the run died while writing it
+                        continue
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.file = open(path, 'a', encoding='utf-8')
+        self.lock = threading.Lock()
+        self.unsynced = 0
+        self.synced_at = time.monotonic()
+
+    def _apply(self, record):
+        if record['type'] == 'audience':
+            previous = self.audiences.get(record['audience_id'], {})
+            self.audiences[record['audience_id']] = {**previous, **record}
+        elif record['type'] == 'stage':
+            self.stages[record['stage']] = record
+
+    def append(self, record):
+        record = {**record, 'time': datetime.now().isoformat(timespec='seconds')}
+        with self.lock:
+            self._apply(record)
+            self.file.write(json.dumps(record, separators=(',', ':')) + '\n')
+            self.file.flush()
+            self.unsynced += 1
+            if self.unsynced >= FSYNC_EVERY_RECORDS or time.monotonic() - self.synced_at >= FSYNC_EVERY_SECONDS:
+                self._sync()
+
+    def _sync(self):
+        os.fsync(self.file.fileno())
+        self.unsynced = 0
+        self.synced_at = time.monotonic()
+
+    def sync(self):
+        with self.lock:
+            self._sync()
+
+    def close(self):
+        with self.lock:
+            self._sync()
+            self.file.close()
+
+    def record_planned(self, audience_id, advertiser_id, company_name, payload, previous_fingerprint=None):
+        """previous_fingerprint: expression_fingerprint of the stored expression the payload replaces"""
+        self.append({'type': 'audience', 'audience_id': audience_id, 'advertiser_id': advertiser_id,
+                     'company_name': company_name, 'status': PENDING, 'payload': payload,
+                     'previous_fingerprint': previous_fingerprint})
+
+    def record_result(self, result):
+        """Record an UpdateResult of the update executor"""
+        self.append({'type': 'audience', 'audience_id': result.audience_id, 'status': result.status,
+                     'response': result.response, 'error': result.error})
+
+    def record_skipped(self, audience_id, reason):
+        """An audience that needs no update any more, e.g. because it was applied by another run"""
+        self.append({'type': 'audience', 'audience_id': audience_id, 'status': APPLIED, 'skipped': reason})
+
+    def record_stage(self, stage, status, detail=None):
+        self.append({'type': 'stage', 'stage': stage, 'status': status, 'detail': detail})
+        # Stage boundaries are always on disk before the next stage starts
+        self.sync()
+
+    def stage_applied(self, stage):
+        return self.stages.get(stage, {}).get('status') == APPLIED
+
+    def audiences_to_apply(self):
+        """
+        (audience_id, advertiser_id, company_name, payload) of the planned audiences that were not
+        applied: failed ones, and pending ones a previous run may not have sent. Re-sending a
+        pending update is safe, it sets the same expression again.
+        """
+        return [(audience_id, entry['advertiser_id'], entry['company_name'], entry['payload'])
+                for audience_id, entry in self.audiences.items() if entry['status'] != APPLIED]
+
+    def previous_fingerprints(self):
+        """{audience_id: fingerprint of the expression its planned update replaces}, for the applied cache"""
+        return {audience_id: entry.get('previous_fingerprint') for audience_id, entry in self.audiences.items()}
+
+    def impacted_advertisers(self):
+        """{advertiser_id: company_name} of the advertisers with an applied update, in this run or a resumed one"""
+        return {entry['advertiser_id']: entry['company_name'] for entry in self.audiences.values()
+                if entry['status'] == APPLIED}
+
+
+def open_journal(name, resume=False, journal_dir=JOURNAL_DIR):
+    """
+    The journal of a run. Without resume, an existing journal of the same name is kept aside
+    (renamed with a timestamp) and a new one is started.
+    """
+    path = os.path.join(journal_dir, f"{name}.jsonl")
+    if not resume and os.path.exists(path):
+        kept_path = os.path.join(journal_dir, f"{name}.{datetime.now().strftime('%Y%m%d_%H%M%S')}.jsonl")
+        os.rename(path, kept_path)
+        print(f"Previous journal kept as {kept_path}")
+    journal = MigrationJournal(path)
+    print(f"{'Resuming' if resume else 'Writing'} journal {path}")
+    return journal
@@ -0,0 +1,106 @@
+import csv
+import os
+import sys
+
+MAPPING_DIR = '../mapping_files'
+
+# Examples listed per kind of problem in a MappingConflictError
+MAX_REPORTED_PROBLEMS = 10
+
+
+class MappingConflictError(ValueError):
+    """Mappings that cannot be applied together; problems lists every conflict and chain found"""
+
+    def __init__(self, problems):
+        self.problems = problems
+        super().__init__("Mappings cannot be applied together:\n" + "\n".join(f"  {problem}" for problem in problems))
+
+
+def read_category_mapping(mapping_file_name, mapping_dir=MAPPING_DIR):
+    """
+    {origin cat: [target cats]} of a mapping file with origin_data_source_category_id and
+    target_data_source_category_id columns; an origin category mapped twice lists both targets,
+    the target of its last row last
+    """
+    mapping = {}
+    with open(os.path.join(mapping_dir, mapping_file_name), 'r', encoding='utf-8') as f:
+        for line in csv.DictReader(f):
+            targets = mapping.setdefault(int(line['origin_data_source_category_id']), [])
+            target = int(line['target_data_source_category_id'])
+            if target in targets:
+                targets.remove(target)
+            targets.append(target)
+    return mapping
+
+
+def read_migration_manifest(manifest_file):
+    """
+    (origin data source id, target data source id, mapping file) of every row of a manifest CSV with
+    source_id,target_id,mapping_file columns, the manifest format of enrich-mapping. An empty
+    mapping_file maps every category of the origin data source as is to the target data source.
+    """
+    with open(manifest_file, 'r', encoding='utf-8') as f:
+        return [(int(line['source_id']), int(line['target_id']), line['mapping_file'].strip() or None)
+                for line in csv.DictReader(f)]
+
+
+def compose_mappings(entries, read_mapping=read_category_mapping):
+    """
+    Compose (origin data source id, target data source id, mapping file or None) entries into the
+    mappings of one ExpressionRewriter.
+    :return: (category mapping {(origin ds, cat): (target ds, cat)}, data source mapping {origin ds: target ds})
+    A category mapped to several targets within one file keeps the target of its last row, as
+    mapping files have always been read, with a warning.
+    :raises MappingConflictError: when a category or data source is mapped to two different targets by
+            different entries, or a target is itself mapped (a chain, which would need a second migration)
+    """
+    category_mapping = {}
+    # (origin ds, cat) -> mapping file it comes from
+    category_sources = {}
+    data_source_mapping = {}
+    conflicts = []
+    for origin_data_source_id, target_data_source_id, mapping_file in entries:
+        if mapping_file is None:
+            previous = data_source_mapping.setdefault(origin_data_source_id, target_data_source_id)
+            if previous != target_data_source_id:
+                conflicts.append(f"data source {origin_data_source_id} is mapped to both data source {previous} "
+                                 f"and data source {target_data_source_id}")
+            continue
+        ambiguous = 0
+        for origin_cat, target_cats in read_mapping(mapping_file).items():
+            key = (origin_data_source_id, origin_cat)
+            ambiguous += len(target_cats) > 1
+            target = (target_data_source_id, target_cats[-1])
+            previous = category_mapping.setdefault(key, target)
+            category_sources.setdefault(key, mapping_file)
+            if previous != target:
+                conflicts.append(f"category {key} is mapped to {previous} in {category_sources[key]} "
+                                 f"and to {target} in {mapping_file}")
+        if ambiguous:
+            print(f"Warning: {ambiguous} categories of {mapping_file} have several target categories, "
+                  f"the last one is used", file=sys.stderr)
+
+    overlapping = sorted({origin_data_source_id for origin_data_source_id, _ in category_mapping}
+                         & set(data_source_mapping))
+    conflicts.extend(f"data source {data_source_id} is mapped as a whole and by category" for data_source_id in overlapping)
+
+    origin_data_source_ids = {origin_data_source_id for origin_data_source_id, _ in category_mapping}
+    chains = [f"category {key} is mapped to {target}, which is mapped to "
+              f"{category_mapping.get(target) or f'data source {data_source_mapping.get(target[0])}'}"
+              for key, target in category_mapping.items()
+              if target in category_mapping or target[0] in data_source_mapping]
+    chains.extend(f"data source {origin_data_source_id} is mapped to data source {target_data_source_id}, "
+                  f"which is itself mapped"
+                  for origin_data_source_id, target_data_source_id in data_source_mapping.items()
+                  if target_data_source_id in data_source_mapping or target_data_source_id in origin_data_source_ids)
+
+    problems = []
+    for kind, found in [('conflicting', conflicts), ('chained', chains)]:
+        if found:
+            problems.append(f"{len(found)} {kind} mappings:")
+            problems.extend(f"  {problem}" for problem in found[:MAX_REPORTED_PROBLEMS])
+            if len(found) > MAX_REPORTED_PROBLEMS:
+                problems.append(f"  ... and {len(found) - MAX_REPORTED_PROBLEMS} more")
+    if problems:
+        raise MappingConflictError(problems)
+    return category_mapping, data_source_mapping
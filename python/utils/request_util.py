@@ -8,8 +8,17 @@ import requests
 from python.utils.authorization import get_oauth_token, delete_cache
 from python.utils.config import config
 
+
+class HttpRequestError(Exception):
+    """Error response of a request, with its http status code"""
+
+    def __init__(self, message, status_code):
+        super().__init__(message)
+        self.status_code = status_code
+
+
 def send(method, url, query_params=None, path_param_key=None, path_param_value=None, request_headers=None,
-         json_data=None, do_lr_auth=False, retry_timer=5):
+         json_data=None, do_lr_auth=False, retry_timer=5, timeout=None):
     """
     Sends an http request. Retrieves LiveRamp auth token if needed (TODO: not tested yet).
     Attempts to retry the request if the status
@@ -23,10 +32,13 @@ def send(method, url, query_params=None, path_param_key=None, path_param_value=N
     :param request_headers: the headers to send with the request
     :param json_data: the body of the request in json format
     :param do_lr_auth: whether to use auth logic for LiveRamp
-    :param retry_timer: the time to wait before retrying the request
+    :param retry_timer: the time to wait before retrying the request, 0 to not retry (the caller handles
+                        retries and back-off)
+    :param timeout: seconds to wait for the server, None to wait forever; requests.exceptions.Timeout is raised
+                    after that
     :return: the response in json format or
              None for 201 with no id - sometimes occurs for enable_segments_url and add_segments_to_dm_url
-    :exception: Exception for all status codes except 200, 201, and 207
+    :exception: HttpRequestError for all status codes except 200, 201, and 207
     """
     if path_param_key is not None:
         url = url.replace(path_param_key, str(path_param_value))
@@ -39,13 +51,13 @@ def send(method, url, query_params=None, path_param_key=None, path_param_value=N
         request_headers['LR-Org-Id'] = api_config['org_id']
     response = {'status_code': 500, 'reason': 'System Error'}
     if method == 'GET':
-        response = requests.get(url, headers=request_headers)
+        response = requests.get(url, headers=request_headers, timeout=timeout)
     elif method == 'POST':
-        response = requests.post(url, headers=request_headers, json=json_data)
+        response = requests.post(url, headers=request_headers, json=json_data, timeout=timeout)
     elif method == 'PUT':
-        response = requests.put(url, headers=request_headers, json=json_data)
+        response = requests.put(url, headers=request_headers, json=json_data, timeout=timeout)
     elif method == 'DELETE':
-        response = requests.delete(url, headers=request_headers, json=json_data)
+        response = requests.delete(url, headers=request_headers, json=json_data, timeout=timeout)
     status_code = response.status_code
     if str(status_code).startswith('2'):
         try:
@@ -53,12 +65,12 @@ def send(method, url, query_params=None, path_param_key=None, path_param_value=N
         except requests.exceptions.JSONDecodeError:
             return None
     elif str(status_code) == '502' or str(status_code) == '504':
-        handle_retry(method, url, request_headers, query_params, path_param_key, path_param_value, json_data, response,
-                     do_lr_auth, retry_timer)
+        return handle_retry(method, url, request_headers, query_params, path_param_key, path_param_value, json_data,
+                            response, do_lr_auth, retry_timer, timeout)
     elif do_lr_auth and str(status_code) == '401' or str(status_code) == '403':
         delete_cache()
-        handle_retry(method, url, request_headers, query_params, path_param_key, path_param_value, json_data, response,
-                     do_lr_auth, retry_timer)
+        return handle_retry(method, url, request_headers, query_params, path_param_key, path_param_value, json_data,
+                            response, do_lr_auth, retry_timer, timeout)
     else:
         # crash 500, 400, 422
         handle_error(response, url, print_error=True, raise_exception=True, request_headers=request_headers,
@@ -85,12 +97,12 @@ def handle_error(response, url, print_error=True, raise_exception=True, request_
     if print_error:
         print(error, file=sys.stderr)
     if raise_exception:
-        raise Exception(error)
+        raise HttpRequestError(error, response.status_code)
 
 
 def handle_retry(method, url, request_headers, query_params, path_param_key, path_param_value, data, response,
-                 do_lr_auth, retry_timer):
-    if retry_timer != 0 and retry_timer > 40:
+                 do_lr_auth, retry_timer, timeout=None):
+    if retry_timer == 0 or retry_timer > 40:
         handle_error(response, url, print_error=True, raise_exception=True, request_headers=request_headers,
                      json_data=data)
     else:
@@ -101,4 +113,4 @@ def handle_retry(method, url, request_headers, query_params, path_param_key, pat
         retry_timer *= 2
         return send(method=method, url=url, query_params=query_params, path_param_key=path_param_key,
                     path_param_value=path_param_value, request_headers=request_headers, json_data=data,
-                    do_lr_auth=do_lr_auth, retry_timer=retry_timer)
+                    do_lr_auth=do_lr_auth, retry_timer=retry_timer, timeout=timeout)
@@ -0,0 +1,228 @@
+import sys
+import threading
+import time
+import traceback
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+# Bounds and starting point of the adaptive rate controller
+DEFAULT_MIN_RATE = 1.0
+DEFAULT_MAX_RATE = 50.0
+DEFAULT_INITIAL_RATE = 5.0
+DEFAULT_MAX_CONCURRENCY = 16
+DEFAULT_INITIAL_CONCURRENCY = 2
+
+# Targets the controller keeps audience-service within while speeding up
+DEFAULT_TARGET_P95_SECONDS = 2.0
+DEFAULT_MAX_ERROR_RATE = 0.05
+
+# Results per control window; the rate and concurrency are reconsidered after every window
+CONTROL_WINDOW = 20
+RATE_INCREASE = 1.0
+DECREASE_FACTOR = 0.5
+# p95 latency above this multiple of the previous window's counts as rising
+P95_RISE_FACTOR = 1.5
+
+# Attempts of an update failing with a 5xx, 429, timeout or connection error; the controller backs off in between
+MAX_ATTEMPTS = 3
+
+# Outcome of one audience update; status is 'applied' or 'failed'
+UpdateResult = namedtuple('UpdateResult', ['audience_id', 'advertiser_id', 'company_name', 'status', 'response',
+                                           'error', 'seconds'])
+
+
+def is_overload_error(error):
+    """5xx and 429 responses, timeouts and connection errors: signs audience-service needs less load"""
+    if isinstance(error, (requests.exceptions.Timeout, requests.exceptions.ConnectionError, TimeoutError)):
+        return True
+    status_code = getattr(error, 'status_code', None)
+    return status_code is not None and (status_code >= 500 or status_code == 429)
+
+
+class RateLimiter:
+    """Token bucket shared by all workers: at most rate requests per second, with bursts of up to burst"""
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def set_rate(self, rate):
+        with self.lock:
+            self._refill()
+            self.rate = rate
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class AdaptiveRateController:
+    """
+    Additive increase, multiplicative decrease of the request rate and concurrency of audience-service calls.
+    While a window of results stays within the p95 latency and error rate targets, the rate grows by
+    RATE_INCREASE requests per second and the concurrency by one. An overload error (5xx, 429, timeout), a
+    window over target or a rising p95 latency cuts both by DECREASE_FACTOR, at most once per window so
+    the failures of requests already in flight do not compound.
+    """
+
+    def __init__(self, initial_rate=DEFAULT_INITIAL_RATE, min_rate=DEFAULT_MIN_RATE, max_rate=DEFAULT_MAX_RATE,
+                 initial_concurrency=DEFAULT_INITIAL_CONCURRENCY, max_concurrency=DEFAULT_MAX_CONCURRENCY,
+                 target_p95_seconds=DEFAULT_TARGET_P95_SECONDS, max_error_rate=DEFAULT_MAX_ERROR_RATE,
+                 window=CONTROL_WINDOW):
+        # A max_rate below the default min_rate lowers the floor too
+        self.min_rate = min(min_rate, max_rate)
+        self.max_rate = max_rate
+        self.rate = min(max(initial_rate, min_rate), max_rate)
+        self.max_concurrency = max_concurrency
+        self.concurrency = min(max(initial_concurrency, 1), max_concurrency)
+        self.target_p95_seconds = target_p95_seconds
+        self.max_error_rate = max_error_rate
+        self.window = window
+        self.rate_limiter = RateLimiter(self.rate)
+        self.condition = threading.Condition()
+        self.in_flight = 0
+        self.latencies = []
+        self.errors = 0
+        self.previous_p95 = None
+        self.results = 0
+        # Number of results at the last decrease
+        self.decreased_at = -window
+
+    def acquire_slot(self):
+        """Block until fewer than concurrency requests are in flight"""
+        with self.condition:
+            self.condition.wait_for(lambda: self.in_flight < self.concurrency)
+            self.in_flight += 1
+
+    def release_slot(self):
+        with self.condition:
+            self.in_flight -= 1
+            self.condition.notify_all()
+
+    def acquire(self):
+        """Wait until the current request rate allows one more request"""
+        self.rate_limiter.acquire()
+
+    def record(self, seconds, error=None):
+        """Feed back the latency and error of one request"""
+        with self.condition:
+            self.results += 1
+            if error is not None and is_overload_error(error):
+                self._decrease()
+                return
+            self.latencies.append(seconds)
+            self.errors += error is not None
+            if len(self.latencies) < self.window:
+                return
+            latencies = sorted(self.latencies)
+            p95 = latencies[int(0.95 * (len(latencies) - 1))]
+            error_rate = self.errors / len(latencies)
+            rising = self.previous_p95 is not None and p95 > self.previous_p95 * P95_RISE_FACTOR
+            self.latencies = []
+            self.errors = 0
+            self.previous_p95 = p95
+            if p95 > self.target_p95_seconds or error_rate > self.max_error_rate or rising:
+                self._decrease()
+            else:
+                self._set(self.rate + RATE_INCREASE, self.concurrency + 1)
+
+    def _decrease(self):
+        if self.results - self.decreased_at < self.window:
+            return
+        self.decreased_at = self.results
+        self.latencies = []
+        self.errors = 0
+        self._set(self.rate * DECREASE_FACTOR, int(self.concurrency * DECREASE_FACTOR))
+
+    def _set(self, rate, concurrency):
+        self.rate = min(max(rate, self.min_rate), self.max_rate)
+        self.concurrency = min(max(concurrency, 1), self.max_concurrency)
+        self.rate_limiter.set_rate(self.rate)
+        self.condition.notify_all()
+
+    def describe(self):
+        return f"rate {self.rate:.1f}/s, concurrency {self.concurrency}"
+
+
+def run_updates(updates, update_function, controller=None, total=None, on_result=None):
+    """
+    Apply audience updates concurrently, as fast as the adaptive rate controller allows.
+    :param updates: iterable of (audience_id, advertiser_id, company_name, payload); it is consumed
+                    lazily, only as many updates as the controller's concurrency are in flight at any time
+    :param update_function: called as update_function(audience_id, payload) from a worker thread
+    :param controller: AdaptiveRateController pacing the updates, a default one when None
+    :param total: number of updates, only used for progress output
+    :param on_result: called with every UpdateResult as soon as it is known (from a worker thread)
+    :return: list of UpdateResult in the order the updates were given
+    """
+    if controller is None:
+        controller = AdaptiveRateController()
+    progress = {'done': 0, 'failed': 0}
+    progress_lock = threading.Lock()
+    started = time.perf_counter()
+
+    def apply(audience_id, advertiser_id, company_name, payload):
+        start = time.perf_counter()
+        for attempt in range(1, MAX_ATTEMPTS + 1):
+            controller.acquire()
+            request_start = time.perf_counter()
+            try:
+                response = update_function(audience_id, payload)
+                controller.record(time.perf_counter() - request_start)
+                result = UpdateResult(audience_id, advertiser_id, company_name, 'applied', response, None,
+                                      time.perf_counter() - start)
+                break
+            except Exception as e:
+                controller.record(time.perf_counter() - request_start, e)
+                if is_overload_error(e) and attempt < MAX_ATTEMPTS:
+                    print(f"  → Retrying audience {audience_id} ({controller.describe()}): {e}", file=sys.stderr)
+                    continue
+                print(f"  → Error updating audience {audience_id}: {e}", file=sys.stderr)
+                traceback.print_exc()
+                result = UpdateResult(audience_id, advertiser_id, company_name, 'failed', None, str(e),
+                                      time.perf_counter() - start)
+                break
+        if on_result is not None:
+            on_result(result)
+        with progress_lock:
+            progress['done'] += 1
+            progress['failed'] += result.status == 'failed'
+            elapsed = time.perf_counter() - started
+            print(f"done - [{progress['done']}/{total if total is not None else '?'}] "
+                  f"({progress['failed']} failed, {progress['done'] / elapsed:.1f} updates/s, "
+                  f"{controller.describe()})")
+        return result
+
+    futures = []
+    with ThreadPoolExecutor(max_workers=controller.max_concurrency) as executor:
+        for audience_id, advertiser_id, company_name, payload in updates:
+            controller.acquire_slot()
+            future = executor.submit(apply, audience_id, advertiser_id, company_name, payload)
+            future.add_done_callback(lambda _: controller.release_slot())
+            futures.append(future)
+    return [future.result() for future in futures]
+
+
+def print_update_summary(results):
+    failed = [result for result in results if result.status == 'failed']
+    print(f"Applied {len(results) - len(failed)} of {len(results)} audience updates")
+    if failed:
+        print(f"Failed audience updates ({len(failed)}):")
+        for result in failed:
+            print(f"  {result.audience_id}: {result.error}")